@@ -4,13 +4,11 @@ from collections import deque
 from copy import copy
 
 import numpy as np
-import shapely.geometry as geom
 from scipy.optimize import NonlinearConstraint, Bounds, basinhopping, LinearConstraint
 
-from bezier_util import bezier_acceleration, bezier_speed, bezier_trajectory, bezier_arc_length
+from bezier_util import bezier_arc_length, bezier_evaluate, plan_basis
 from car_modes import DriveModes, ControlType
-from util import circ_slice, dist, gravitational_acceleration, TPI, log_leq_barrier_function_value, is_greater_than, \
-    log_barrier_function_value
+from util import gravitational_acceleration, TPI, log_leq_barrier_function_value, log_barrier_function_value
 
 
 def bezier_race_optimize(agent, opponent_cars, replan_time, input_update_time):
@@ -37,13 +35,16 @@ def bezier_race_optimize(agent, opponent_cars, replan_time, input_update_time):
     else:
         agent_b_car.race_optimize([])
     actions = deque()
+    taus = []
     t = 0
     while t <= (replan_time) + input_update_time / 2:
+        taus.append(t)
+        t += input_update_time
+    cp = agent_b_car.final_cp
+    _, vel, acc = bezier_evaluate(cp[:agent_b_car.num_cp], cp[agent_b_car.num_cp:agent_b_car.num_cp * 2], taus,
+                                  agent_b_car.bezier_order, agent_b_car.time_horizon)
+    for (x_p, y_p), (x_pp, y_pp) in zip(vel, acc):
         if agent.get_control_type() == ControlType.STEER_ACCELERATE:
-            x_p = bezier_speed(agent_b_car.final_cp[:agent_b_car.num_cp], t, agent_b_car.bezier_order, agent_b_car.time_horizon)
-            x_pp = bezier_acceleration(agent_b_car.final_cp[:agent_b_car.num_cp], t, agent_b_car.bezier_order, agent_b_car.time_horizon)
-            y_p = bezier_speed(agent_b_car.final_cp[agent_b_car.num_cp:agent_b_car.num_cp * 2], t, agent_b_car.bezier_order, agent_b_car.time_horizon)
-            y_pp = bezier_acceleration(agent_b_car.final_cp[agent_b_car.num_cp:agent_b_car.num_cp * 2], t, agent_b_car.bezier_order, agent_b_car.time_horizon)
             sp = (x_p ** 2 + y_p ** 2)
             if sp > 0:
                 acceleration = (x_p * x_pp + y_p * y_pp) / math.sqrt(sp)
@@ -56,10 +57,6 @@ def bezier_race_optimize(agent, opponent_cars, replan_time, input_update_time):
                 st_an = 0
             actions.append((acceleration, st_an, DriveModes.RACE))
         elif agent.get_control_type() == ControlType.MODE_ONLY:
-            x_p = bezier_speed(agent_b_car.final_cp[:agent_b_car.num_cp], t, agent_b_car.bezier_order,
-                               agent_b_car.time_horizon)
-            y_p = bezier_speed(agent_b_car.final_cp[agent_b_car.num_cp:agent_b_car.num_cp * 2], t,
-                               agent_b_car.bezier_order, agent_b_car.time_horizon)
             sp = math.sqrt(x_p ** 2 + y_p ** 2)
             heading = math.atan2(y_p, x_p)
             if heading < 0: heading = heading + TPI
@@ -67,7 +64,6 @@ def bezier_race_optimize(agent, opponent_cars, replan_time, input_update_time):
         else:
             print("Unknown control type")
             exit(1)
-        t += input_update_time
 
     return actions
 
@@ -97,6 +93,12 @@ class BezierCar:
         self.horizon_increment = 5
         self.final_cp = ([self.x] * self.num_cp) + ([self.y] * self.num_cp) + ([25])
         self.track = agent.track
+        self.taus, self.position_basis, self.velocity_basis, self.acceleration_basis = \
+            plan_basis(self.bezier_order, self.time_horizon, self.plan_time_delta)
+
+    def control_points(self, c):
+        # (num_cp, 2) view of the x and y control points in an optimization vector
+        return np.reshape(c[:self.num_cp * 2], (2, self.num_cp)).T
 
     def compute_trajectory_intersection(self, x1, y1, x2, y2, x3, y3, x4, y4):
         dx1 = x2 - x1
@@ -235,106 +237,170 @@ class BezierCar:
         self.initial = initial
         self.ub = ub
         self.lb = lb
-        self.track_horizon = geom.LineString(circ_slice(self.track.center_coords, init_position_index, 200))
 
-    def race_optimize(self, opponent_cars=None):
-        if opponent_cars:
-            opponent_cars = list(filter(lambda c: c != self, opponent_cars))
-        else:
-            opponent_cars = []
-        self.prep_control_points()
-        c_x = self.initial[:self.num_cp]
-        c_y = self.initial[self.num_cp:self.num_cp*2]
+    def objective_and_constraints(self, opponent_cars):
+        """
+        The objective race_optimize minimizes, returning its value and gradient, and its constraints with their
+        Jacobians, as functions of the optimization vector c. Needs prep_control_points to have run.
+        """
+        # The objective is sampled from plan_time_delta onwards, the constraints from 0
+        position_basis = self.position_basis[1:]
+        velocity_basis = self.velocity_basis[1:]
+        acceleration_basis = self.acceleration_basis[1:]
+        opponent_positions = [position_basis @ self.control_points(o.final_cp) for o in opponent_cars]
+        opponent_progress = np.array([self.track.progress(o.ipx, o.final_cp[self.num_cp-1], o.final_cp[self.num_cp*2-1])[0][0]
+                                      for o in opponent_cars])
+        # Progress is compared in arc length, scaled to average center points so the weights keep their meaning
+        point_spacing = self.track.track_length / len(self.track.center_coords)
+
+        def progress(c):
+            # Arc length reached by the final control point and its gradient with respect to c
+            s, gradient = self.track.progress(self.ipx, c[self.num_cp-1], c[self.num_cp*2-1])
+            grad = np.zeros(len(c))
+            grad[self.num_cp-1], grad[self.num_cp*2-1] = gradient[0]
+            return s[0], grad
+        min_separation = math.sqrt(self.car_width**2 + self.car_length**2)
+
         def opt(c):
+            # Returns the objective and its gradient with respect to c
             total = 0
-            t = self.plan_time_delta
-            while t <= self.time_horizon + self.plan_time_delta / 2:
-                if t > self.time_horizon - self.plan_time_delta / 2: t = self.time_horizon
-                x_p = bezier_speed(c[:self.num_cp], t, self.bezier_order, self.time_horizon)
-                x_pp = bezier_acceleration(c[:self.num_cp], t, self.bezier_order, self.time_horizon)
-                y_p = bezier_speed(c[self.num_cp:self.num_cp*2], t, self.bezier_order, self.time_horizon)
-                y_pp = bezier_acceleration(c[self.num_cp:self.num_cp*2], t, self.bezier_order, self.time_horizon)
-                sp = math.sqrt(x_p ** 2 + y_p ** 2)
-                sp1 = math.sqrt((x_p + x_pp*self.plan_time_delta)**2 + (y_p + y_pp*self.plan_time_delta)**2)
-                ac = math.sqrt(x_pp ** 2 + y_pp ** 2)
-
-                long_acc = 0.5 * (2 * x_pp * (x_p) + 2 * y_pp * (y_p)) / (math.sqrt((x_p) ** 2 + (y_p) ** 2))
-                if math.isclose(ac, abs(long_acc)) or math.isnan(long_acc) or math.isinf(long_acc):
-                    long_acc = ac
-                lat_acc = math.sqrt(ac**2 - long_acc**2)
-
-                def acc_penalty(c):
-                    if is_greater_than(sp1, sp, rel_tol=0.001) or math.isclose(sp1, sp, rel_tol=0.001):
-                        return min(0, abs(self.max_braking) - long_acc) + min(0, self.max_gs*gravitational_acceleration - lat_acc)
-                    else:
-                        return min(0, self.acceleration_bound(sp) - long_acc) + min(0, self.max_gs*gravitational_acceleration - lat_acc)
-
-                if opponent_cars:
-                    for o in opponent_cars:
-                        con4 = lambda c: dist(bezier_trajectory(c[:self.num_cp], t, self.bezier_order, self.time_horizon),
-                                              bezier_trajectory(c[self.num_cp:self.num_cp*2], t, self.bezier_order, self.time_horizon),
-                                              bezier_trajectory(o.final_cp[:self.num_cp], t, self.bezier_order, self.time_horizon),
-                                              bezier_trajectory(o.final_cp[self.num_cp:self.num_cp*2], t, self.bezier_order, self.time_horizon))
-                        total -= (500) * min(0, con4(c) - (math.sqrt(self.car_width**2 + self.car_length**2)))
-                total -= 50 * acc_penalty(c)
-                # total -= 10 * vel_penalty(c)
-                # total -= 10 * steer_penalty(c)
-                total -= 20/(self.time_horizon/self.plan_time_delta) * sp
-                total += 45 * self.track.distance_to_center_custom_range(bezier_trajectory(c[:self.num_cp], t, self.bezier_order, self.time_horizon),
-                                                                         bezier_trajectory(c[self.num_cp:self.num_cp*2], t, self.bezier_order, self.time_horizon),
-                                                                         self.ipx, self.ipx + self.max_point_horizon)
-                t += self.plan_time_delta
-            if opponent_cars:
-                for opp in opponent_cars:
-                    total -= (6 / len(opponent_cars)) * (
-                                self.track.find_pos_index(self.ipx, c[self.num_cp-1], c[self.num_cp*2-1]) -
-                                self.track.find_pos_index(opp.ipx, opp.final_cp[self.num_cp-1], opp.final_cp[self.num_cp*2-1]))
+            cp = self.control_points(c)
+            pos, vel, acc = position_basis @ cp, velocity_basis @ cp, acceleration_basis @ cp
+            grad_pos = np.zeros_like(pos)
+            grad_vel = np.zeros_like(vel)
+            grad_acc = np.zeros_like(acc)
+            x_p, y_p = vel[:, 0], vel[:, 1]
+            x_pp, y_pp = acc[:, 0], acc[:, 1]
+            sp = np.hypot(x_p, y_p)
+            sp1 = np.hypot(x_p + x_pp*self.plan_time_delta, y_p + y_pp*self.plan_time_delta)
+            ac = np.hypot(x_pp, y_pp)
+            moving = sp > 0
+            safe_sp = np.where(moving, sp, 1)[:, None]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                long_acc = (x_pp * x_p + y_pp * y_p) / sp
+            degenerate = ~np.isfinite(long_acc) | np.isclose(ac, np.abs(long_acc), rtol=1e-9, atol=0)
+            long_acc = np.where(degenerate, ac, long_acc)
+            lat_acc = np.sqrt(np.maximum(ac**2 - long_acc**2, 0))
+
+            # Same test as is_greater_than(sp1, sp, rel_tol=0.001) or math.isclose(sp1, sp, rel_tol=0.001)
+            slowing = (sp1 > sp) | (np.abs(sp1 - sp) <= np.maximum(0.001 * np.maximum(sp1, sp), 1e-6))
+            long_bound = np.array([abs(self.max_braking) if b else self.acceleration_bound(v) for b, v in zip(slowing, sp)])
+            long_excess = long_bound - long_acc < 0
+            lat_excess = self.max_gs*gravitational_acceleration - lat_acc < 0
+            acc_penalty = np.where(long_excess, long_bound - long_acc, 0) + np.where(lat_excess, self.max_gs*gravitational_acceleration - lat_acc, 0)
+
+            # d(long_acc) and d(lat_acc) with respect to velocity and acceleration
+            d_long_d_vel = np.where(degenerate[:, None], 0, acc / safe_sp - long_acc[:, None] * vel / safe_sp ** 2)
+            safe_ac = np.where(ac > 0, ac, 1)[:, None]
+            d_long_d_acc = np.where(degenerate[:, None], acc / safe_ac, vel / safe_sp)
+            lateral = (lat_acc > 0)[:, None]
+            safe_lat = np.where(lateral, lat_acc[:, None], 1)
+            d_lat_d_vel = np.where(lateral, -long_acc[:, None] * d_long_d_vel / safe_lat, 0)
+            d_lat_d_acc = np.where(lateral, (acc - long_acc[:, None] * d_long_d_acc) / safe_lat, 0)
+
+            for o_pos in opponent_positions:
+                offset = pos - o_pos
+                separation = np.hypot(*offset.T)
+                close = separation < min_separation
+                total -= (500) * np.sum(np.where(close, separation - min_separation, 0))
+                safe_separation = np.where(separation > 0, separation, 1)[:, None]
+                grad_pos -= 500 * np.where(close[:, None] & (separation > 0)[:, None], offset / safe_separation, 0)
+            total -= 50 * np.sum(acc_penalty)
+            grad_vel += 50 * (long_excess[:, None] * d_long_d_vel + lat_excess[:, None] * d_lat_d_vel)
+            grad_acc += 50 * (long_excess[:, None] * d_long_d_acc + lat_excess[:, None] * d_lat_d_acc)
+            speed_weight = 20/(self.time_horizon/self.plan_time_delta)
+            total -= speed_weight * np.sum(sp)
+            grad_vel -= speed_weight * np.where(moving[:, None], vel / safe_sp, 0)
+            center_distance, closest = self.track.closest_center_points(pos[:, 0], pos[:, 1], self.ipx, self.ipx + self.max_point_horizon)
+            to_center = pos - closest
+            total += 45 * np.sum(center_distance)
+            grad_pos += 45 * np.where((center_distance > 0)[:, None], to_center / np.where(center_distance > 0, center_distance, 1)[:, None], 0)
             total -= 0.2 * (c[-1] - self.ipx)
-            return total
+
+            grad_cp = position_basis.T @ grad_pos + velocity_basis.T @ grad_vel + acceleration_basis.T @ grad_acc
+            grad = np.zeros(len(c))
+            grad[:self.num_cp * 2] = grad_cp.T.ravel()
+            grad[-1] = -0.2
+            if opponent_cars:
+                s, grad_s = progress(c)
+                total -= (6 / len(opponent_cars)) * np.sum(s - opponent_progress) / point_spacing
+                grad -= 6 * grad_s / point_spacing
+            return total, grad
 
         constraints = []
 
         # Speed Constraints
-        t = 0
-        while t <= self.time_horizon + self.plan_time_delta / 2:
-            if t > self.time_horizon - self.plan_time_delta / 2: t = self.time_horizon
-            con = lambda c: bezier_speed(c[:self.num_cp], t, self.bezier_order, self.time_horizon) ** 2 + bezier_speed(c[self.num_cp:self.num_cp*2], t, self.bezier_order, self.time_horizon) ** 2
-            nlc = NonlinearConstraint(con, 0, self.max_vel ** 2)
-            constraints.append(nlc)
+        def speed_con(c):
+            vel = self.velocity_basis @ self.control_points(c)
+            return np.sum(vel ** 2, axis=1)
 
-            t += self.plan_time_delta
+        def speed_jac(c):
+            vel = self.velocity_basis @ self.control_points(c)
+            jac = np.zeros((len(self.taus), len(c)))
+            jac[:, :self.num_cp] = 2 * vel[:, [0]] * self.velocity_basis
+            jac[:, self.num_cp:self.num_cp*2] = 2 * vel[:, [1]] * self.velocity_basis
+            return jac
+
+        constraints.append(NonlinearConstraint(speed_con, 0, self.max_vel ** 2, jac=speed_jac))
 
         # Steering Angle Constraints
-        t = 0
-        while t <= self.time_horizon + self.plan_time_delta / 2:
-            if t > self.time_horizon - self.plan_time_delta / 2: t = self.time_horizon
-
-            def con(c):
-                x_p = bezier_speed(c[:self.num_cp], t, self.bezier_order, self.time_horizon)
-                x_pp = bezier_acceleration(c[:self.num_cp], t, self.bezier_order, self.time_horizon)
-                y_p = bezier_speed(c[self.num_cp:self.num_cp*2], t, self.bezier_order, self.time_horizon)
-                y_pp = bezier_acceleration(c[self.num_cp:self.num_cp*2], t, self.bezier_order, self.time_horizon)
-                sp = (x_p ** 2 + y_p ** 2)
-                return math.atan(((x_p * y_pp - y_p * x_pp) / (sp ** 1.5)) * self.car_length) * 180 / math.pi
-
-            nlc = NonlinearConstraint(con, -self.max_steering_angle, self.max_steering_angle)
-            constraints.append(nlc)
-            t += self.plan_time_delta
-
-        con = lambda c: self.track.find_pos_index(self.ipx, c[self.num_cp-1],c[self.num_cp*2 -1]) - self.ipx
-        nlc = NonlinearConstraint(con, self.min_point_horizon, self.max_point_horizon)
+        def curvature(c):
+            cp = self.control_points(c)
+            vel, acc = self.velocity_basis @ cp, self.acceleration_basis @ cp
+            sp = np.sum(vel ** 2, axis=1)
+            numerator = vel[:, 0] * acc[:, 1] - vel[:, 1] * acc[:, 0]
+            moving = sp > 0
+            sp = np.where(moving, sp, 1)
+            return vel, acc, sp, numerator, moving, np.where(moving, numerator / sp ** 1.5, 0)
+
+        def steering_con(c):
+            k = curvature(c)[-1]
+            return np.degrees(np.arctan(k * self.car_length))
+
+        def steering_jac(c):
+            vel, acc, sp, numerator, moving, k = curvature(c)
+            x_p, y_p = vel.T
+            x_pp, y_pp = acc.T
+            dk_dxp = y_pp / sp ** 1.5 - 3 * numerator * x_p / sp ** 2.5
+            dk_dyp = -x_pp / sp ** 1.5 - 3 * numerator * y_p / sp ** 2.5
+            dk_dxpp = -y_p / sp ** 1.5
+            dk_dypp = x_p / sp ** 1.5
+            scale = np.where(moving, np.degrees(self.car_length / (1 + (self.car_length * k) ** 2)), 0)[:, None]
+            jac = np.zeros((len(self.taus), len(c)))
+            jac[:, :self.num_cp] = scale * (dk_dxp[:, None] * self.velocity_basis + dk_dxpp[:, None] * self.acceleration_basis)
+            jac[:, self.num_cp:self.num_cp*2] = scale * (dk_dyp[:, None] * self.velocity_basis + dk_dypp[:, None] * self.acceleration_basis)
+            return jac
+
+        constraints.append(NonlinearConstraint(steering_con, -self.max_steering_angle, self.max_steering_angle, jac=steering_jac))
+
+        # The final control point has to land between min_point_horizon and max_point_horizon center points ahead
+        start_s = self.track.index_to_s(self.ipx)
+        nlc = NonlinearConstraint(lambda c: progress(c)[0] - start_s, self.track.index_to_s(self.ipx + self.min_point_horizon) - start_s,
+                                  self.track.index_to_s(self.ipx + self.max_point_horizon) - start_s, jac=lambda c: progress(c)[1])
         constraints.append(nlc)
-        print("Initial x speed", bezier_speed(self.initial[:self.num_cp], 0, self.bezier_order, self.time_horizon), "Initial y speed",
-              bezier_speed(self.initial[self.num_cp:self.num_cp*2], 0, self.bezier_order, self.time_horizon),
-              "Initial x acc", bezier_acceleration(self.initial[:self.num_cp], 0, self.bezier_order, self.time_horizon), "Initial y acc",
-              bezier_acceleration(self.initial[self.num_cp:self.num_cp*2], 0, self.bezier_order, self.time_horizon))
+        return opt, constraints
+
+    def race_optimize(self, opponent_cars=None):
+        if opponent_cars:
+            opponent_cars = list(filter(lambda c: c != self, opponent_cars))
+        else:
+            opponent_cars = []
+        self.prep_control_points()
+        c_x = self.initial[:self.num_cp]
+        c_y = self.initial[self.num_cp:self.num_cp*2]
+        opt, constraints = self.objective_and_constraints(opponent_cars)
+        init_vel = self.velocity_basis[0] @ self.control_points(self.initial)
+        init_acc = self.acceleration_basis[0] @ self.control_points(self.initial)
+        print("Initial x speed", init_vel[0], "Initial y speed", init_vel[1],
+              "Initial x acc", init_acc[0], "Initial y acc", init_acc[1])
         print("init control x=", c_x)
         print("init control y=", c_y)
         print("init lb=", self.lb)
         print("init ub=", self.ub)
         self.bounds = Bounds(self.lb, self.ub)
         print(datetime.datetime.now())
-        result = basinhopping(opt, self.initial, niter=10, minimizer_kwargs={'bounds': self.bounds, 'constraints': constraints, 'method': 'SLSQP',
+        result = basinhopping(opt, self.initial, niter=10, minimizer_kwargs={'bounds': self.bounds, 'constraints': constraints, 'method': 'SLSQP', 'jac': True,
                                                                        'options': {'maxiter': 10}}, take_step=self.take_step)
         print(datetime.datetime.now())
         if math.nan not in result.x and math.inf not in result.x:
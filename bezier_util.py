@@ -1,7 +1,7 @@
 import math
 from functools import lru_cache, reduce
 
-from util import dist
+import numpy as np
 
 
 @lru_cache(maxsize=None)
@@ -30,14 +30,51 @@ def bezier_acceleration(c, tau, bezier_order, time_horizon):
                       range(0, bezier_order-1)))
 
 
+def _bernstein_matrix(order, s):
+    i = np.arange(order + 1)
+    coefficients = np.array([comb(order, k) for k in i], dtype=float)
+    return coefficients * (1 - s[:, None]) ** (order - i) * s[:, None] ** i
+
+
+@lru_cache(maxsize=128)
+def bernstein_basis(bezier_order, taus, time_horizon):
+    # Matrices mapping the (bezier_order + 1) control points to position, velocity and acceleration at every tau in
+    # the grid. taus must be a tuple so that the grid can be part of the cache key.
+    s = np.asarray(taus, dtype=float) / time_horizon
+    n = bezier_order
+    position = _bernstein_matrix(n, s)
+    velocity = np.zeros_like(position)
+    if n >= 1:
+        velocity = n / time_horizon * (_bernstein_matrix(n - 1, s) @ np.diff(np.eye(n + 1), 1, axis=0))
+    acceleration = np.zeros_like(position)
+    if n >= 2:
+        acceleration = n * (n - 1) / time_horizon ** 2 * (_bernstein_matrix(n - 2, s) @ np.diff(np.eye(n + 1), 2, axis=0))
+    for m in (position, velocity, acceleration):
+        m.setflags(write=False)
+    return position, velocity, acceleration
+
+
+def bezier_evaluate(cx, cy, taus, bezier_order, time_horizon):
+    # Returns (len(taus), 2) arrays of position, velocity and acceleration for the x/y control points
+    position, velocity, acceleration = bernstein_basis(bezier_order, tuple(taus), time_horizon)
+    c = np.column_stack((cx, cy))
+    return position @ c, velocity @ c, acceleration @ c
+
+
+def plan_time_grid(time_horizon, time_delta):
+    # Samples 0, dt, 2dt, ... with the last sample snapped to the horizon, as the planner's time loops do
+    samples = int(math.floor(time_horizon / time_delta + 0.5))
+    return tuple(k * time_delta for k in range(samples)) + (time_horizon,)
+
+
+@lru_cache(maxsize=32)
+def plan_basis(bezier_order, time_horizon, time_delta):
+    taus = plan_time_grid(time_horizon, time_delta)
+    return (taus, *bernstein_basis(bezier_order, taus, time_horizon))
+
+
 def bezier_arc_length(cx, cy, time_horizon, precision=0.05,):
-    tau1 = 0
-    tau2 = tau1 + precision
-    d = 0.0
-    bezier_order = len(cx) - 1
-    while tau1 < time_horizon:
-        update = dist(bezier_trajectory(cx, tau2, bezier_order, time_horizon), bezier_trajectory(cy, tau2, bezier_order, time_horizon), bezier_trajectory(cx, tau1, bezier_order, time_horizon), bezier_trajectory(cy, tau1, bezier_order, time_horizon))
-        d += update
-        tau1 = tau2
-        tau2 += precision
-    return d
\ No newline at end of file
+    segments = int(math.ceil(time_horizon / precision - 1e-9))
+    taus = tuple(k * precision for k in range(segments + 1))
+    position, _, _ = bezier_evaluate(cx, cy, taus, len(cx) - 1, time_horizon)
+    return float(np.sum(np.hypot(*np.diff(position, axis=0).T)))
\ No newline at end of file
@@ -64,9 +64,8 @@ class DiscreteInputModeCar(Car):
                                        self.max_acceleration, self.max_braking, self.max_gs, self.max_vel,
                                        self.max_steering_angle, manager_params)
 
-    def input_steer_accelerate_command(self, acceleration, steering_angle, mode, time_step):
-        cars_ahead = self.track.cars_ahead[self]
-        cars_side = self.track.cars_side[self]
+    def switch_steer_accelerate_command(self, acceleration, steering_angle, time_step):
+        # First half of input_steer_accelerate_command, which picks the next mode. FleetState.bicycle_step then moves the car.
         if steering_angle < -math.radians(self.max_steering_angle):
             steering_angle = -math.radians(self.max_steering_angle)
         if steering_angle > math.radians(self.max_steering_angle):
@@ -78,14 +77,22 @@ class DiscreteInputModeCar(Car):
         target_v = self.state.v + acceleration * time_step
         avg_v = (self.state.v + target_v)/2
         target_heading = self.state.heading + (avg_v * math.tan(steering_angle) * math.cos(self.state.side_slip) / (self.length)) * time_step
-        input_mode = (target_v, target_heading)
-        acceleration, steering_angle, mode = self.state.update(input_mode, self.length / 2, self.length / 2, time_step, self.track, cars_ahead=cars_ahead, cars_side=cars_side)
-        return acceleration, steering_angle, mode
+        self.switch_mode_command((target_v, target_heading), time_step)
+
+    def switch_mode_command(self, mode, time_step):
+        # First half of input_mode_command, which picks the next mode. FleetState.bicycle_step then moves the car.
+        self.state.switch_mode(self.state.mode if mode is None else mode, time_step,
+                               cars_ahead=self.track.cars_ahead[self], cars_side=self.track.cars_side[self],
+                               footprints=self.track.footprints)
+
+    def input_steer_accelerate_command(self, acceleration, steering_angle, mode, time_step):
+        self.switch_steer_accelerate_command(acceleration, steering_angle, time_step)
+        return self._step(time_step)
 
     def input_mode_command(self, mode, time_step):
-        cars_ahead = self.track.cars_ahead[self]
-        cars_side = self.track.cars_side[self]
-        if mode == None:
-            return self.state.update(self.state.mode, self.length / 2, self.length / 2, time_step, self.track, cars_ahead=cars_ahead, cars_side=cars_side)
-        else:
-            return self.state.update(mode, self.length / 2, self.length / 2, time_step, self.track, cars_ahead=cars_ahead, cars_side=cars_side)
\ No newline at end of file
+        self.switch_mode_command(mode, time_step)
+        return self._step(time_step)
+
+    def _step(self, time_step):
+        acceleration, steering_angle = self.state.fleet.bicycle_step([self.state.slot], [self.length / 2], [self.length / 2], time_step)
+        return acceleration[0], steering_angle[0], self.state.mode
@@ -1,12 +1,158 @@
 import math
+import os
+from collections import OrderedDict
 from enum import Enum
 import numpy as np
 from scipy import optimize
-import scipy.stats as stats
 from scipy.optimize import Bounds
 
-from util import round_to_fraction, gravitational_acceleration, find_smallest_rotation, is_cw, TPI, rect_from_center, \
-    dist, pos_estimate_functions, is_greater_than, log_leq_barrier_function_value
+from collisions import box_corners, boxes_intersect, overlap_areas
+from util import round_to_fraction, gravitational_acceleration, find_smallest_rotation, is_cw, TPI, dist, pos_estimates, \
+    is_greater_than, log_leq_barrier_function_value, TruncatedNormalSampler
+
+
+def max_accelerations(initial_v, initial_h, target_v, target_h, dt):
+    """
+    Largest normal (cornering) and tangential (longitudinal) acceleration magnitudes over [0, dt] of a mode switch that
+    interpolates the velocity vector linearly, V(t) = Vi + a*t. Since a x V(t) = a x Vi is constant, the normal
+    acceleration |a x Vi| / |V(t)| peaks where |V(t)| is smallest and the tangential one, sqrt(|a|^2 - a_n^2), where
+    |V(t)| is largest, which is at one of the ends. Accepts scalars or arrays of transitions.
+    """
+    initial_v, initial_h, target_v, target_h = np.broadcast_arrays(*map(np.asarray, (initial_v, initial_h,
+                                                                                    target_v, target_h)))
+    vxi = initial_v * np.cos(initial_h)
+    vyi = initial_v * np.sin(initial_h)
+    ax = (target_v * np.cos(target_h) - vxi) / dt
+    ay = (target_v * np.sin(target_h) - vyi) / dt
+    a_sq = ax ** 2 + ay ** 2
+    cross = ax * vyi - ay * vxi
+    # a parallel to Vi up to rounding, e.g. braking through zero into the opposite heading, has no normal acceleration
+    cross_sq = np.where(np.abs(cross) <= 1e-9 * np.sqrt(a_sq) * np.abs(initial_v), 0, cross ** 2)
+    # Time of the smallest speed, where V(t) is perpendicular to a unless that lies outside of the step
+    t = np.clip(-np.divide(ax * vxi + ay * vyi, a_sq, out=np.zeros_like(a_sq), where=a_sq > 0), 0, dt)
+    min_v_sq = (vxi + ax * t) ** 2 + (vyi + ay * t) ** 2
+    max_v_sq = np.maximum(initial_v ** 2, target_v ** 2)
+    # V(t) only passes through zero when it is parallel to a, in which case there is no normal acceleration
+    max_n = np.sqrt(np.divide(cross_sq, min_v_sq, out=np.zeros_like(a_sq), where=min_v_sq > 0))
+    max_t = np.sqrt(np.maximum(a_sq - np.divide(cross_sq, max_v_sq, out=np.zeros_like(a_sq), where=max_v_sq > 0), 0))
+    return max_n, max_t
+
+
+def _isclose(a, b, rel_tol, abs_tol):
+    # math.isclose for arrays, np.isclose is not symmetric in a and b
+    return np.abs(a - b) <= np.maximum(rel_tol * np.maximum(np.abs(a), np.abs(b)), abs_tol)
+
+
+# Limit flags of the entries of a TransitionTable
+WITHIN_ACCELERATION = 1
+WITHIN_BRAKING = 2
+WITHIN_CORNERING = 4
+
+_transition_tables = {}
+_transition_table_dir = None
+
+
+def _grid_index(value, precision):
+    index = round(value / precision)
+    return index if math.isclose(value / precision, index, abs_tol=1e-6) else None
+
+
+class TransitionTable:
+    """
+    Which acceleration limits a mode switch of an InputModes profile respects over a time step dt. The maximum
+    accelerations only depend on the two velocities and the change in heading, so the entries are indexed by the two
+    velocity grid indices and the difference of the heading grid indices, whatever the absolute heading. Rows, one per
+    pair of velocities, are built on first use and at most max_rows of them are kept in memory. With a path, rows are
+    read from and saved to an .npz file.
+    """
+    def __init__(self, modes, dt, path=None, max_rows=4096):
+        self.modes = modes
+        self.dt = dt
+        self.path = path
+        self.max_rows = max_rows
+        self.velocities = np.arange(math.floor(modes.max_v / modes.v_prec + 1e-6) + 1) * modes.v_prec
+        self.max_turn = math.ceil(TPI / modes.h_prec - 1e-6)
+        self.turns = np.arange(-self.max_turn, self.max_turn + 1) * modes.h_prec
+        self.rows = OrderedDict()
+        self.new_rows = set()
+        self._stored = None
+        # NpzFile.files is a list, so membership is looked up in a set of the names instead
+        self._stored_names = set()
+        if path is not None and os.path.exists(path):
+            self._stored = np.load(path)
+            self._stored_names = set(self._stored.files)
+
+    def _build_row(self, i, j):
+        max_n, max_t = max_accelerations(self.velocities[i], 0, self.velocities[j], self.turns, self.dt)
+        return self.modes.limit_flags(max_n, max_t)
+
+    def row(self, i, j):
+        key = (i, j)
+        row = self.rows.get(key)
+        if row is not None:
+            self.rows.move_to_end(key)
+            return row
+        name = f"row_{i}_{j}"
+        if name in self._stored_names:
+            row = self._stored[name]
+        else:
+            row = self._build_row(i, j)
+            self.new_rows.add(key)
+        self.rows[key] = row
+        if len(self.rows) > self.max_rows:
+            # A new row that is evicted before the next save is simply rebuilt when it is needed again
+            evicted, _ = self.rows.popitem(last=False)
+            self.new_rows.discard(evicted)
+        return row
+
+    def limits(self, mode, targetv, targeth):
+        # WITHIN_* flags of the switch from mode to (targetv, targeth), or None when either is off the mode grid
+        i = _grid_index(mode[0], self.modes.v_prec)
+        j = _grid_index(targetv, self.modes.v_prec)
+        h1 = _grid_index(mode[1], self.modes.h_prec)
+        h2 = _grid_index(targeth, self.modes.h_prec)
+        if i is None or j is None or h1 is None or h2 is None:
+            return None
+        if not (0 <= i < len(self.velocities) and 0 <= j < len(self.velocities) and abs(h2 - h1) <= self.max_turn):
+            return None
+        return int(self.row(i, j)[h2 - h1 + self.max_turn])
+
+    def save(self):
+        if self.path is None or not self.new_rows:
+            return
+        rows = {}
+        if self._stored is not None:
+            rows.update((name, self._stored[name]) for name in self._stored.files)
+            self._stored.close()
+        rows.update((f"row_{i}_{j}", self.rows[i, j]) for i, j in self.new_rows)
+        np.savez_compressed(self.path, **rows)
+        self.new_rows.clear()
+        self._stored = np.load(self.path)
+        self._stored_names = set(self._stored.files)
+
+
+def set_transition_table_dir(table_dir):
+    # Directory the transition tables created from now on are read from and saved to
+    global _transition_table_dir
+    _transition_table_dir = table_dir
+
+
+def transition_table(modes, dt):
+    # One shared table per car profile and time step
+    key = (modes.max_acc, modes.max_brak, modes.max_corn, modes.max_v, modes.v_prec, modes.h_prec, dt)
+    table = _transition_tables.get(key)
+    if table is None:
+        path = None
+        if _transition_table_dir is not None:
+            path = os.path.join(_transition_table_dir, "transitions_" + "_".join(f"{k:g}" for k in key) + ".npz")
+        table = TransitionTable(modes, dt, path)
+        _transition_tables[key] = table
+    return table
+
+
+def save_transition_tables():
+    for table in _transition_tables.values():
+        table.save()
 
 
 class DriveModes(Enum):
@@ -17,7 +163,7 @@ class DriveModes(Enum):
 
 
 class InputModes:
-    def __init__(self, max_acceleration, max_braking, max_cornering_gs, max_velocity, max_steering_angle, vel_precision=0.5, heading_precision= TPI/1000):
+    def __init__(self, max_acceleration, max_braking, max_cornering_gs, max_velocity, max_steering_angle, vel_precision=0.5, heading_precision= TPI/1000, seed=None):
         self.max_acc = max_acceleration
         self.max_brak = max_braking
         self.max_corn = max_cornering_gs * gravitational_acceleration
@@ -26,6 +172,8 @@ class InputModes:
         self.total_modes = (int(max_velocity/vel_precision) + 1) * (int(TPI/heading_precision) + 1)
         self.v_prec = vel_precision
         self.h_prec = heading_precision
+        # Randomness of the fallback switches in try_switch
+        self.sampler = TruncatedNormalSampler(seed)
 
     def mode_from_velocity_heading(self, velocity, heading):
         v = round_to_fraction(velocity, self.v_prec)
@@ -35,59 +183,45 @@ class InputModes:
         return (v, h)
 
     def _find_max_cornering_acc(self, mode, targetv, targeth, dt):
-        initialv, initialh = mode
-        vxi = initialv * math.cos(initialh)
-        vyi = initialv * math.sin(initialh)
-        vxf = targetv * math.cos(targeth)
-        vyf = targetv * math.sin(targeth)
-        ax = (vxf - vxi) / dt
-        ay = (vyf - vyi) / dt
-        a = math.sqrt((ax ** 2) + (ay ** 2))
-
-        def opt_n(t):
-            a_t = 0.5 * (2 * ax * (vxi + ax * t) + 2 * ay * (vyi + ay * t)) / (
-                math.sqrt((vxi + ax * t) ** 2 + (vyi + ay * t) ** 2))
-            if math.isclose(abs(a), abs(a_t)) or math.isnan(a_t) or math.isinf(a_t):
-                return 0
-            a_n = math.sqrt((a ** 2) - (a_t) ** 2)
-            return -(a_n ** 2)
-
-        result = optimize.minimize_scalar(opt_n, bounds=(0, dt), method='bounded')
-        return math.sqrt(-result.fun)
+        max_n, _ = max_accelerations(mode[0], mode[1], targetv, targeth, dt)
+        return float(max_n)
 
     def _find_max_longitudnal_acc(self, mode, targetv, targeth, dt):
-        initialv, initialh = mode
-        vxi = initialv * math.cos(initialh)
-        vyi = initialv * math.sin(initialh)
-        vxf = targetv * math.cos(targeth)
-        vyf = targetv * math.sin(targeth)
-        ax = (vxf - vxi) / dt
-        ay = (vyf - vyi) / dt
-
-        def opt_t(t):
-            a_t = 0.5 * (2 * ax * (vxi + ax * t) + 2 * ay * (vyi + ay * t)) / (
-                math.sqrt((vxi + ax * t) ** 2 + (vyi + ay * t) ** 2))
-            if math.isnan(a_t) or math.isinf(a_t):
-                return 0
-            return -(a_t ** 2)
-
-        result = optimize.minimize_scalar(opt_t, bounds=(0, dt), method='bounded')
-        return math.sqrt(-result.fun)
+        _, max_t = max_accelerations(mode[0], mode[1], targetv, targeth, dt)
+        return float(max_t)
+
+    def limit_flags(self, max_n, max_t):
+        # WITHIN_* flags of maximum accelerations, with the same tolerance as not is_greater_than(..., rel_tol=0.01)
+        within_acc = (max_t <= self.max_acc) | _isclose(max_t, self.max_acc, 0.01, 1e-6)
+        within_brak = (max_t <= abs(self.max_brak)) | _isclose(max_t, abs(self.max_brak), 0.01, 1e-6)
+        within_corn = (max_n <= self.max_corn) | _isclose(max_n, self.max_corn, 0.01, 1e-6)
+        return (within_acc * WITHIN_ACCELERATION | within_brak * WITHIN_BRAKING
+                | within_corn * WITHIN_CORNERING).astype(np.uint8)
+
+    def transition_limits(self, mode, targetv, targeth, dt):
+        # WITHIN_* flags of a single switch, looked up in the transition table of this profile whenever possible
+        flags = transition_table(self, dt).limits(mode, targetv, targeth)
+        if flags is None:
+            flags = int(self.limit_flags(*max_accelerations(mode[0], mode[1], targetv, targeth, dt)))
+        return flags
+
+    @staticmethod
+    def _feasible(flags, speeding_up):
+        long_flag = np.where(speeding_up, WITHIN_ACCELERATION, WITHIN_BRAKING)
+        return (flags & long_flag != 0) & (flags & WITHIN_CORNERING != 0)
 
     def _within_braking_limit(self, mode, v, h, dt):
-        return not is_greater_than(self._find_max_longitudnal_acc(mode, v, h, dt), abs(self.max_brak), rel_tol=0.01)
+        return bool(self.transition_limits(mode, v, h, dt) & WITHIN_BRAKING)
 
     def _within_acc_limit(self, mode, v, h, dt):
-        return not is_greater_than(self._find_max_longitudnal_acc(mode, v, h, dt), self.max_acc, rel_tol=0.01)
+        return bool(self.transition_limits(mode, v, h, dt) & WITHIN_ACCELERATION)
 
     def _within_corn_limit(self, mode, v, h, dt):
-        return not is_greater_than(self._find_max_cornering_acc(mode, v, h, dt), self.max_corn, rel_tol=0.01)
+        return bool(self.transition_limits(mode, v, h, dt) & WITHIN_CORNERING)
 
     def is_transition_feasible(self, vh1, vh2, dt):
         speeding_up = is_greater_than(vh1[0], vh2[0]) or math.isclose(vh1[0], vh2[0])
-        return ((speeding_up and self._within_acc_limit(vh1, vh2[0], vh2[1], dt))
-                or (not speeding_up and self._within_braking_limit(vh1, vh2[0], vh2[1], dt))) and \
-                self._within_corn_limit(vh1, vh2[0], vh2[1], dt)
+        return bool(self._feasible(self.transition_limits(vh1, vh2[0], vh2[1], dt), speeding_up))
 
     def _find_best_collision_avoidance_vh_pair(self, car_state, targetv, targeth, init_v, init_h, other_trajectories, dt):
         mode = car_state.mode
@@ -97,11 +231,12 @@ class InputModes:
         targetx = targetv*math.cos(targeth)
         targety = targetv*math.sin(targeth)
         def opt(x):
-            max_c = (max(0, self._find_max_cornering_acc(mode, x[0], x[1], dt) - self.max_corn))**2
+            max_n, max_t = max_accelerations(mode[0], mode[1], x[0], x[1], dt)
+            max_c = (max(0, max_n - self.max_corn))**2
             if is_greater_than(x[0], mode[0], rel_tol=0.001) or math.isclose(x[0], mode[0], rel_tol=0.001):
-                max_a = (max(0, self._find_max_longitudnal_acc(mode, x[0], x[1], dt) - self.max_acc))**2
+                max_a = (max(0, max_t - self.max_acc))**2
             else:
-                max_a = (max(0, self._find_max_longitudnal_acc(mode, x[0], x[1], dt) - abs(self.max_brak)))**2
+                max_a = (max(0, max_t - abs(self.max_brak)))**2
             xx = x[0]*math.cos(x[1])
             xy = x[0]*math.sin(x[1])
             return dist(targetx, targety, xx, xy) + 500*self._area_of_collisions_with_cars(car_state, x[0], x[1], other_trajectories, dt) - 5*x[0] + \
@@ -148,63 +283,56 @@ class InputModes:
         return abs(result.x)
 
     def _estimate_position_rectangles(self, state, dt):
-        # vi = state.v
-        # hi = state.heading
-        # hf = math.atan2((state.dy + state.d2y*dt), (state.dx + state.d2x*dt))
-        # vf = math.sqrt((state.dy + state.d2y*dt)**2 + (state.dx + state.d2x*dt)**2)
-        # x_pos_f, y_pos_f, h_pos_f = self._pos_functions(state.x, state.y, vi, vf, hi, hf, dt)
-        # print(state.old_x, state.old_y, state.last_mode[0], state.mode[0], state.last_mode[1], state.mode[1], dt)
-        x_pos_f, y_pos_f, h_pos_f = pos_estimate_functions(state.old_x, state.old_y, state.old_v, state.v, state.old_heading, state.heading, dt)
-        return [rect_from_center(x, y, state.l, state.w, h) for x, y, h in zip(map(x_pos_f, np.linspace(0, dt)),
-                                                                               map(y_pos_f, np.linspace(0, dt)),
-                                                                               map(h_pos_f, np.linspace(0, dt)))]
+        # Corners, shape (50, 4, 2), of the footprints of state over its last switch
+        xs, ys, hs = pos_estimates(state.old_x, state.old_y, state.old_v, state.v, state.old_heading, state.heading, dt)
+        return box_corners(xs, ys, state.l, state.w, hs)
 
     def _generate_position_rectangles(self, state, targetv, targeth, dt):
-        x_pos_f, y_pos_f, h_pos_f = pos_estimate_functions(state.x, state.y, state.v, targetv, state.heading, targeth, dt)
-        return [rect_from_center(x, y, state.l, state.w, h) for x, y, h in zip(map(x_pos_f, np.linspace(0, dt)),
-                                                                               map(y_pos_f, np.linspace(0, dt)),
-                                                                               map(h_pos_f, np.linspace(0, dt)))]
+        xs, ys, hs = pos_estimates(state.x, state.y, state.v, targetv, state.heading, targeth, dt)
+        return box_corners(xs, ys, state.l, state.w, hs)
 
     def _no_collisions_with_cars(self, car_state, targetv, targeth, other_trajectories, dt):
         # to avoid collisions with cars and trajectories we need to make sure bounding boxes don't intersect as traveling
-        new_rectangles = self._generate_position_rectangles(car_state, targetv, targeth, dt)
         if not len(other_trajectories): return True
-        return not any(ours.intersects(theirs) for c in other_trajectories for ours, theirs in zip(new_rectangles, other_trajectories[c]))
+        new_rectangles = self._generate_position_rectangles(car_state, targetv, targeth, dt)
+        return not boxes_intersect(new_rectangles, np.stack(list(other_trajectories.values()))).any()
 
     def _area_of_collisions_with_cars(self, car_state, targetv, targeth, other_trajectories, dt):
         # to avoid collisions with cars and trajectories we need to make sure bounding boxes don't intersect as traveling
-        new_rectangles = self._generate_position_rectangles(car_state, targetv, targeth, dt)
         if not len(other_trajectories): return 0
-        return sum(ours.intersection(theirs).area for c in other_trajectories for ours, theirs in zip(new_rectangles, other_trajectories[c]))
+        new_rectangles = self._generate_position_rectangles(car_state, targetv, targeth, dt)
+        return float(overlap_areas(new_rectangles, np.stack(list(other_trajectories.values()))).sum())
 
-    def try_switch(self, car_state, velocity, heading, time_step, cars_ahead=None, cars_side=None):
+    def try_switch(self, car_state, velocity, heading, time_step, cars_ahead=None, cars_side=None, footprints=None):
         targetv = velocity
         targeth = heading
         other_trajectories = {}
         mode = car_state.mode
-        if cars_ahead and len(cars_ahead):
-            for car in cars_ahead:
-                other_trajectories[car] = self._estimate_position_rectangles(car, time_step)
-        if cars_side and len(cars_side):
-            for car in cars_side:
+        for car in (cars_ahead or []) + (cars_side or []):
+            if footprints is not None:
+                other_trajectories[car] = footprints.get(car, time_step, self._estimate_position_rectangles)
+            else:
                 other_trajectories[car] = self._estimate_position_rectangles(car, time_step)
         best_v = velocity
         best_h = math.fmod(heading, TPI) if heading > 0 else math.fmod(heading+TPI, TPI)
         rvelocity, rheading = self.mode_from_velocity_heading(best_v, best_h)
-        max_corn = self._find_max_cornering_acc(mode, rvelocity, rheading, time_step)
-        max_long = self._find_max_longitudnal_acc(mode, rvelocity, rheading, time_step)
         speeding_up = (is_greater_than(rvelocity, mode[0], rel_tol=0.001) or math.isclose(rvelocity, mode[0], rel_tol=0.001))
-        no_collisions = self._no_collisions_with_cars(car_state, rvelocity, rheading, other_trajectories, time_step)
-        within_acceleration = speeding_up and self._within_acc_limit(mode, rvelocity, rheading, time_step)
-        within_cornering = self._within_corn_limit(mode, rvelocity, rheading, time_step)
-        within_braking = not speeding_up and self._within_braking_limit(mode, rvelocity, rheading, time_step)
-        if (within_acceleration or within_braking) and within_cornering and no_collisions:
+        limits = self.transition_limits(mode, rvelocity, rheading, time_step)
+        within_acceleration = speeding_up and bool(limits & WITHIN_ACCELERATION)
+        within_cornering = bool(limits & WITHIN_CORNERING)
+        within_braking = not speeding_up and bool(limits & WITHIN_BRAKING)
+        within_limits = (within_acceleration or within_braking) and within_cornering
+        # The collision check is only needed, and only reported, for a switch the car can make
+        no_collisions = within_limits and self._no_collisions_with_cars(car_state, rvelocity, rheading, other_trajectories, time_step)
+        if within_limits and no_collisions:
             print("Current Mode", mode, "Input Mode", (velocity, heading), "Resulting Mode", (rvelocity, rheading))
             return rvelocity, rheading, (rvelocity, rheading)
         else:
+            max_corn, max_long = map(float, max_accelerations(mode[0], mode[1], rvelocity, rheading, time_step))
             print("Within acceleration limit:" if speeding_up else "Within braking limit: ", within_acceleration if speeding_up else within_braking, max_long, self.max_acc if speeding_up else self.max_brak)
             print("Within cornering limit: ", within_cornering, max_corn, self.max_corn)
-            print("No collsions: ", no_collisions)
+            if within_limits:
+                print("No collsions: ", no_collisions)
             if speeding_up and (not within_acceleration):
                 # Not enough power
                 new_rvelocity = self._find_best_acc(car_state, rvelocity, rheading, other_trajectories, time_step)
@@ -220,18 +348,16 @@ class InputModes:
                 new_rheading = rheading
             best_v, best_h = self._find_best_collision_avoidance_vh_pair(car_state, targetv, targeth, new_rvelocity, new_rheading, other_trajectories, time_step)
             mean_dv = (best_v - mode[0])
-            sd = self.v_prec
             print("meandv", mean_dv)
-            v_dist = stats.truncnorm((min(mean_dv - 1e-6, 0) - mean_dv) / sd,
-                                     (max(mean_dv + 1e-6, 0) - mean_dv) / sd, loc=mean_dv, scale=sd)
-            final_v = v_dist.rvs(1)[0] + mode[0]
 
             mean_dh = find_smallest_rotation(best_h, mode[1])
-            sd = self.h_prec
             print("meandh", mean_dh)
-            h_dist = stats.truncnorm((min(mean_dh - 1e-6, 0) - mean_dh) / sd,
-                                     (max(mean_dh + 1e-6, 0) - mean_dh) / sd, loc=mean_dh, scale=sd)
-            final_h = h_dist.rvs(1)[0] + mode[1]
+            # Both changes are drawn between 0 and their mean, in one call
+            means = np.array([mean_dv, mean_dh])
+            dv, dh = self.sampler.sample(means, [self.v_prec, self.h_prec], np.minimum(means - 1e-6, 0),
+                                         np.maximum(means + 1e-6, 0))
+            final_v = dv + mode[0]
+            final_h = dh + mode[1]
             final_h = math.fmod(final_h, TPI) if final_h > 0 else math.fmod(final_h + TPI, TPI)
             rvelocity, rheading = self.mode_from_velocity_heading(final_v, final_h)
             print("Current Mode", mode, "Input Mode", (velocity, heading), "Resulting Mode", (rvelocity, rheading))
@@ -1,11 +1,21 @@
 import math
 
+import numpy as np
+
 from car_modes import DriveModes, InputModes
-from util import dist, find_smallest_rotation
+from fleet_state import FleetField, FleetState
 
 
 class CarState:
+    x, y, old_x, old_y = FleetField(), FleetField(), FleetField(), FleetField()
+    dx, dy, d2x, d2y = FleetField(), FleetField(), FleetField(), FleetField()
+    v, old_v, heading, old_heading, side_slip = FleetField(), FleetField(), FleetField(), FleetField(), FleetField()
+    tpx, s, d, l, w = FleetField(), FleetField(), FleetField(), FleetField(), FleetField()
+
     def __init__(self, x, y, dx, dy, d2x, d2y, heading, length, width,  track):
+        # The kinematic state lives in the track's FleetState, this object is a view of its slot
+        self.fleet = track.fleet if track else FleetState(None)
+        self.slot = self.fleet.add()
         self.x = x
         self.y = y
         self.old_x = x
@@ -19,12 +29,16 @@ class CarState:
         self.heading = heading
         self.old_heading = self.heading
         self.side_slip = 0
-        if track: self.tpx = track.find_pos_index(0, x, y)
+        if track: self.fleet.relocate([self.slot])
         self.mode = None
         self.last_mode = None
         self.l = length
         self.w = width
 
+    @property
+    def version(self):
+        return int(self.fleet.version[self.slot])
+
     def update(self, acceleration, steering_angle, mode, lr, lf, time_step, track, **kwargs):
         raise NotImplementedError()
 
@@ -53,42 +67,55 @@ class FourModeCarState(CarState):
         self.side_slip = math.atan((lr * math.tan(steering_angle)) / (lr + lf))
         self.last_mode = self.mode
         self.mode = mode
-        self.tpx = track.find_pos_index(self.tpx, self.x, self.y)
+        self.fleet.relocate([self.slot])
         return self._race_mode_acc_contol(acceleration, steering_angle, mode, time_step, track, **kwargs)
 
     def _race_mode_acc_contol(self, acceleration, steering_angle, mode, time_step, track, **kwargs):
-        new_v = self.v + acceleration * time_step
-        # Iteratively reduce true acceleration input until no more collisions
-        # If no acceleration input is feasible then collision is unavoidable and return max braking
-        # (it is inexact and somewhat inefficient, but it suffices for simulation)
-        if new_v < 0:
-            new_v = 0
-        while True:
-            collision = False
-            new_dx = new_v * math.cos(self.side_slip + self.heading)
-            new_dy = new_v * math.sin(self.side_slip + self.heading)
-            new_x = self.x + new_dx * time_step
-            new_y = self.y + new_dy * time_step
-            for other_car in track.vehicles_on_track:
-                if other_car.state is self: continue
-                s = other_car.state
-                oc_dx = s.v * math.cos(self.side_slip + self.heading)
-                oc_dy = s.v * math.sin(self.side_slip + self.heading)
-                oc_x = s.x + oc_dx * time_step
-                oc_y = s.y + oc_dy * time_step
-                if dist(new_x, new_y, oc_x, oc_y) < 2:
-                    acceleration = max(kwargs['max_braking'], acceleration - 0.05)
-                    new_v = self.v + acceleration * time_step
-                    if new_v < 0:
-                        self.old_v = self.v
-                        self.v = 0
-                        return acceleration, steering_angle, mode
-                    collision = True
+        """
+        Lowers the acceleration input in 0.05 steps until the car stays 2m clear of where every other car would be if it
+        kept its speed along this car's heading. If no acceleration is feasible then collision is unavoidable and the
+        result is max braking. Rather than trying every step, each other car forbids an open interval of new speeds,
+        so the search jumps straight to the first step below the interval it is in.
+        """
+        max_braking = kwargs['max_braking']
+        direction = np.array([math.cos(self.side_slip + self.heading), math.sin(self.side_slip + self.heading)]) * time_step
+        slots = np.array([c.state.slot for c in track.vehicles_on_track if c.state is not self], dtype=int)
+        relative = np.column_stack((self.x - self.fleet.x[slots], self.y - self.fleet.y[slots]))
+        # |relative + (new_v - other_v) * direction| < 2 is a quadratic inequality in new_v
+        qa = direction @ direction
+        qb = 2 * relative @ direction
+        qc = np.sum(relative ** 2, axis=1) - 4
+        if qa > 0:
+            disc = qb ** 2 - 4 * qa * qc
+            overlapping = disc > 0
+            root = np.sqrt(np.where(overlapping, disc, 0))
+            low = ((-qb - root) / (2 * qa) + self.fleet.v[slots])[overlapping]
+            high = ((-qb + root) / (2 * qa) + self.fleet.v[slots])[overlapping]
+        else:
+            low = np.full(np.count_nonzero(qc < 0), -np.inf)
+            high = -low
+
+        def forbidden_below(speed):
+            # Lowest bound of the forbidden intervals that contain speed, or None if it is safe
+            inside = (low < speed) & (speed < high)
+            return low[inside].min() if inside.any() else None
+
+        new_v = max(self.v + acceleration * time_step, 0)
+        if forbidden_below(new_v) is not None:
+            # The first steps that reach max braking or a negative speed, where the search ends regardless of collisions
+            brake_step = max(1, math.ceil((acceleration - max_braking) / 0.05))
+            stop_step = max(1, math.floor((acceleration + self.v / time_step) / 0.05) + 1)
+            step = 1
+            while step < min(brake_step, stop_step):
+                bound = forbidden_below(self.v + (acceleration - 0.05 * step) * time_step)
+                if bound is None:
                     break
-            if not collision or acceleration == kwargs['max_braking']:
-                self.old_v = self.v
-                self.v = new_v
-                return acceleration, steering_angle, mode
+                step = max(step + 1, math.ceil((acceleration - (bound - self.v) / time_step) / 0.05))
+            acceleration = max(max_braking, acceleration - 0.05 * min(step, brake_step, stop_step))
+            new_v = max(self.v + acceleration * time_step, 0)
+        self.old_v = self.v
+        self.v = new_v
+        return acceleration, steering_angle, mode
 
     def _update_pass_mode(self, acceleration, steering_angle, mode, lr, lf, time_step, track, **kwargs):
         pass
@@ -109,7 +136,8 @@ class InputModeCarState(CarState):
     def __init__(self, x, y, dx, dy, d2x, d2y, heading,  track, length, width, max_acceleration, max_braking, max_cornering_gs, max_velocity, max_steering_angle, manager_params=None):
         super().__init__(x, y, dx, dy, d2x, d2y, heading, length, width, track)
         if manager_params:
-            self.mode_manager = InputModes(max_acceleration, max_braking, max_cornering_gs, max_velocity, max_steering_angle, manager_params['v_prec'], manager_params['h_prec'])
+            self.mode_manager = InputModes(max_acceleration, max_braking, max_cornering_gs, max_velocity, max_steering_angle, manager_params['v_prec'], manager_params['h_prec'],
+                                           manager_params.get('seed'))
         else:
             self.mode_manager = InputModes(max_acceleration, max_braking, max_cornering_gs, max_velocity, max_steering_angle)
         self.mode = self.mode_manager.mode_from_velocity_heading(self.v, heading)
@@ -120,30 +148,19 @@ class InputModeCarState(CarState):
         self.old_heading = self.heading
 
 
+    def switch_mode(self, mode, time_step, **kwargs):
+        self.old_heading = self.heading
+        self.old_v = self.v
+        self.last_mode = self.mode
+        self.v, self.heading, self.mode = self.mode_manager.try_switch(self, mode[0], mode[1], time_step, cars_ahead=kwargs['cars_ahead'], cars_side=kwargs['cars_side'],
+                                                                       footprints=kwargs.get('footprints'))
+
     def update(self, mode, lr, lf, time_step, track, **kwargs):
         """
         Following Kinematic Bicycle model found: https://dingyan89.medium.com/simple-understanding-of-kinematic-bicycle-model-81cac6420357
         in part 2.3 with some modifications to use average velocity when computing steering angle and average velocity to
-        compute position.
+        compute position. The model itself is FleetState.bicycle_step, which steps many cars at once.
         """
-        self.old_heading = self.heading
-        self.old_v = self.v
-        self.last_mode = self.mode
-        self.v, self.heading, self.mode = self.mode_manager.try_switch(self, mode[0], mode[1], time_step, cars_ahead=kwargs['cars_ahead'], cars_side=kwargs['cars_side'])
-        acceleration = (self.v - self.old_v)/time_step
-        dh = find_smallest_rotation(self.heading, self.old_heading)/time_step if not math.isclose(self.heading - self.old_heading, 0, abs_tol=1e-6) else 0
-        avg_v = (self.v + self.old_v)/2
-        steering_angle = math.atan(dh * (lr + lf)/(avg_v * math.cos(self.side_slip)))
-        new_dx = self.v * math.cos(self.heading + self.side_slip)
-        new_dy = self.v * math.sin(self.heading + self.side_slip)
-        self.old_x = self.x
-        self.old_y = self.y
-        self.x = self.x + (new_dx + self.dx) * time_step * 0.5
-        self.y = self.y + (new_dy + self.dy) * time_step * 0.5
-        self.d2x = (new_dx - self.dx) / time_step
-        self.d2y = (new_dy - self.dy) / time_step
-        self.dx = new_dx
-        self.dy = new_dy
-        self.side_slip = math.atan((lr * math.tan(steering_angle)/(lr + lf)))
-        self.tpx = track.find_pos_index(self.tpx, self.x, self.y)
-        return acceleration, steering_angle, self.mode
+        self.switch_mode(mode, time_step, **kwargs)
+        acceleration, steering_angle = self.fleet.bicycle_step([self.slot], [lr], [lf], time_step)
+        return acceleration[0], steering_angle[0], self.mode
@@ -0,0 +1,228 @@
+import numpy as np
+
+
+def box_bounds(boxes):
+    # Axis-aligned (minx, miny, maxx, maxy) bounds for each box
+    return np.array([box.bounds for box in boxes], dtype=float).reshape(-1, 4)
+
+
+def sweep_and_prune(bounds):
+    """
+    Broadphase over axis-aligned bounds. Sorts the boxes along x once and sweeps an active set, so only boxes whose x
+    intervals overlap are compared on y. Returns the candidate index pairs (i, j) with i < j.
+    """
+    order = np.argsort(bounds[:, 0], kind='stable')
+    pairs = []
+    active = []
+    for i in order:
+        minx, miny, maxx, maxy = bounds[i]
+        active = [j for j in active if bounds[j, 2] >= minx]
+        for j in active:
+            if bounds[j, 1] <= maxy and miny <= bounds[j, 3]:
+                pairs.append((min(i, j), max(i, j)))
+        active.append(i)
+    return sorted(pairs)
+
+
+def find_collisions(boxes, tolerance=.5):
+    """
+    Exact overlap areas of util.OrientedBoxes, computed in one batch for the broadphase candidates only. Returns
+    (i, j, area) for every colliding pair.
+    """
+    pairs = sweep_and_prune(box_bounds(boxes))
+    if not pairs:
+        return []
+    first, second = np.array(pairs).T
+    corners = np.stack([box.corners() for box in boxes])
+    areas = overlap_areas(corners[first], corners[second])
+    return [(i, j, float(area)) for (i, j), area in zip(pairs, areas) if area > tolerance]
+
+
+def box_corners(x, y, l, w, heading):
+    # Corners of oriented boxes in rect_from_center's counterclockwise order (tr, tl, bl, br), shape (..., 4, 2)
+    x, y, l, w, heading = np.broadcast_arrays(*map(np.asarray, (x, y, l, w, heading)))
+    c, s = np.cos(heading), np.sin(heading)
+    along = np.stack([l / 2 * c, l / 2 * s], axis=-1)
+    across = np.stack([-w / 2 * s, w / 2 * c], axis=-1)
+    center = np.stack([x, y], axis=-1)
+    return np.stack([center + along + across, center - along + across, center - along - across,
+                     center + along - across], axis=-2)
+
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def boxes_intersect(corners1, corners2):
+    """
+    Separating axis test between the oriented boxes of corners1 and corners2, broadcast against each other. Like
+    shapely's intersects, touching boxes intersect.
+    """
+    corners1, corners2 = np.broadcast_arrays(corners1, corners2)
+    axes = np.concatenate([corners1[..., 1:3, :] - corners1[..., 0:2, :],
+                           corners2[..., 1:3, :] - corners2[..., 0:2, :]], axis=-2)
+    # Projections of every corner on every axis, shape (..., axis, corner)
+    p1 = np.einsum('...ad,...cd->...ac', axes, corners1)
+    p2 = np.einsum('...ad,...cd->...ac', axes, corners2)
+    separated = (p1.max(axis=-1) < p2.min(axis=-1)) | (p2.max(axis=-1) < p1.min(axis=-1))
+    return ~separated.any(axis=-1)
+
+
+def _inside(points, corners):
+    # Whether each of points (..., n, 2) lies in the counterclockwise box corners (..., 4, 2), boundary included
+    edges = np.roll(corners, -1, axis=-2) - corners
+    offsets = points[..., :, None, :] - corners[..., None, :, :]
+    return (_cross(edges[..., None, :, :], offsets) >= -1e-9).all(axis=-1)
+
+
+def overlap_areas(corners1, corners2):
+    """
+    Exact intersection areas of the oriented boxes of corners1 and corners2, broadcast against each other. The
+    intersection of two convex polygons is the convex polygon spanned by the corners of either that lie in the other
+    and by the crossings of their edges; these are ordered by angle around their mean and summed with the shoelace
+    formula.
+    """
+    corners1, corners2 = np.broadcast_arrays(corners1, corners2)
+    p, r = corners1, np.roll(corners1, -1, axis=-2) - corners1
+    q, s = corners2, np.roll(corners2, -1, axis=-2) - corners2
+    # Crossing of edge i of box 1 with edge j of box 2, shape (..., 4, 4)
+    denom = _cross(r[..., :, None, :], s[..., None, :, :])
+    qp = q[..., None, :, :] - p[..., :, None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = _cross(qp, s[..., None, :, :]) / denom
+        u = _cross(qp, r[..., :, None, :]) / denom
+    crossing = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    crossings = p[..., :, None, :] + np.where(crossing, t, 0)[..., None] * r[..., :, None, :]
+    shape = corners1.shape[:-2]
+    points = np.concatenate([corners1, corners2, crossings.reshape(shape + (16, 2))], axis=-2)
+    valid = np.concatenate([_inside(corners1, corners2), _inside(corners2, corners1), crossing.reshape(shape + (16,))],
+                           axis=-1)
+    count = valid.sum(axis=-1)
+    center = (points * valid[..., None]).sum(axis=-2) / np.maximum(count, 1)[..., None]
+    angles = np.where(valid, np.arctan2(points[..., 1] - center[..., None, 1], points[..., 0] - center[..., None, 0]),
+                      np.inf)
+    order = np.argsort(angles, axis=-1)
+    points = np.take_along_axis(points, order[..., None], axis=-2)
+    valid = np.take_along_axis(valid, order, axis=-1)
+    # Unused slots repeat the first vertex, which adds nothing to the shoelace sum
+    points = np.where(valid[..., None], points, points[..., :1, :])
+    area = 0.5 * _cross(points, np.roll(points, -1, axis=-2)).sum(axis=-1)
+    return np.where(count >= 3, np.abs(area), 0.)
+
+
+class FootprintCache:
+    """
+    Predicted footprints of cars, shared by every car that checks for collisions against them. An entry is computed
+    once per state version and time step, so it is recomputed as soon as its car's state is updated.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, state, dt, estimate):
+        key = (state.version, dt)
+        entry = self.entries.get(state)
+        if entry is None or entry[0] != key:
+            entry = (key, estimate(state, dt))
+            self.entries[state] = entry
+        return entry[1]
+
+
+def box_distances(corners1, corners2):
+    # Distances between the oriented boxes of corners1 and corners2, broadcast against each other, 0 where they intersect
+    corners1, corners2 = np.broadcast_arrays(corners1, corners2)
+
+    def vertex_to_edge(points, corners):
+        edges = (np.roll(corners, -1, axis=-2) - corners)[..., None, :, :]
+        offsets = points[..., :, None, :] - corners[..., None, :, :]
+        t = np.clip((offsets * edges).sum(axis=-1) / np.maximum((edges ** 2).sum(axis=-1), 1e-12), 0, 1)
+        return np.sqrt(((offsets - t[..., None] * edges) ** 2).sum(axis=-1)).min(axis=(-2, -1))
+
+    distances = np.minimum(vertex_to_edge(corners1, corners2), vertex_to_edge(corners2, corners1))
+    return np.where(boxes_intersect(corners1, corners2), 0., distances)
+
+
+def _poses(boxes):
+    # (x, y, l, w, heading) rows of boxes, e.g. util.OrientedBoxes
+    return np.array([(box.x, box.y, box.l, box.w, box.heading) for box in boxes], dtype=float).reshape(-1, 5)
+
+
+def _turns(start, end):
+    # Smallest rotation from the start to the end heading
+    return (end[:, 4] - start[:, 4] + np.pi) % (2 * np.pi) - np.pi
+
+
+def _corners_at(start, end, t):
+    # Corners of boxes whose centers move linearly and that turn at a constant rate from start to end, at times t in [0, 1]
+    center = start[:, :2] + t[:, None] * (end[:, :2] - start[:, :2])
+    return box_corners(center[:, 0], center[:, 1], start[:, 2], start[:, 3], start[:, 4] + t * _turns(start, end))
+
+
+def time_of_impact(start1, end1, start2, end2, tolerance=1e-3):
+    """
+    Earliest time in [0, 1] at which pairs of boxes moving from the poses start to end, as (n, 5) arrays of
+    (x, y, l, w, heading), come within tolerance of each other, or inf where they never do. No point of one box can
+    approach the other faster than their relative center speed plus the speed of their farthest corners, which bounds
+    the distance over a time interval from below by the distances at its ends. Intervals are bisected until that bound
+    clears them, or until they are short enough to close in by less than tolerance. A pair is only reported at a time
+    its distance was measured to be within tolerance, to within the time it takes to close in by tolerance.
+    """
+    radius1 = np.hypot(start1[:, 2], start1[:, 3]) / 2
+    radius2 = np.hypot(start2[:, 2], start2[:, 3]) / 2
+    relative = (end1[:, :2] - start1[:, :2]) - (end2[:, :2] - start2[:, :2])
+    speed = np.hypot(relative[:, 0], relative[:, 1]) + np.abs(_turns(start1, end1)) * radius1 + \
+        np.abs(_turns(start2, end2)) * radius2
+    toi = np.full(len(start1), np.inf)
+
+    def distance(pair, t):
+        return box_distances(_corners_at(start1[pair], end1[pair], t), _corners_at(start2[pair], end2[pair], t))
+
+    # Time intervals [a, b] of pairs still to be searched, with the distances da and db at their ends
+    pair = np.arange(len(start1))
+    a, b = np.zeros(len(pair)), np.ones(len(pair))
+    da, db = distance(pair, a), distance(pair, b)
+    while len(pair):
+        for t, d in ((a, da), (b, db)):
+            np.minimum.at(toi, pair[d <= tolerance], t[d <= tolerance])
+        reach = speed[pair] * (b - a)
+        keep = (a < toi[pair]) & (da > tolerance) & (da + db - reach <= 2 * tolerance) & (reach > tolerance)
+        pair, a, b, da, db = pair[keep], a[keep], b[keep], da[keep], db[keep]
+        m = (a + b) / 2
+        dm = distance(pair, m)
+        pair, a, b, da, db = np.concatenate([pair, pair]), np.concatenate([a, m]), np.concatenate([m, b]), \
+            np.concatenate([da, dm]), np.concatenate([dm, db])
+    return toi
+
+
+def _pose_bounds(poses):
+    c, s = np.cos(poses[:, 4]), np.sin(poses[:, 4])
+    ex = np.abs(poses[:, 2] / 2 * c) + np.abs(poses[:, 3] / 2 * s)
+    ey = np.abs(poses[:, 2] / 2 * s) + np.abs(poses[:, 3] / 2 * c)
+    return np.stack([poses[:, 0] - ex, poses[:, 1] - ey, poses[:, 0] + ex, poses[:, 1] + ey], axis=1)
+
+
+def find_swept_collisions(start_boxes, end_boxes, margin=.1):
+    """
+    Continuous counterpart of find_collisions for boxes moving from start_boxes to end_boxes over one step, which
+    catches cars passing through each other between the two. A pair collides when the boxes, shrunk by margin on every
+    side so that grazing contacts are ignored, touch at some point of the step. The broadphase runs on the bounds of
+    each box's whole motion. Returns (i, j, toi, area) for every colliding pair, toi being the fraction of the step at
+    contact and area the overlap of the full boxes there, which is positive however far apart they end the step.
+    """
+    start, end = _poses(start_boxes), _poses(end_boxes)
+    bounds = np.concatenate([np.minimum(_pose_bounds(start)[:, :2], _pose_bounds(end)[:, :2]),
+                             np.maximum(_pose_bounds(start)[:, 2:], _pose_bounds(end)[:, 2:])], axis=1)
+    # While turning, corners bulge out of the bounds of the end poses by at most the sagitta of their arc
+    bulge = np.hypot(start[:, 2], start[:, 3]) / 2 * (1 - np.cos(_turns(start, end) / 2))
+    bounds += np.outer(bulge, [-1, -1, 1, 1])
+    pairs = sweep_and_prune(bounds)
+    if not pairs:
+        return []
+    first, second = np.array(pairs).T
+    shrunk = [np.column_stack([poses[:, :2], np.maximum(poses[:, 2:4] - 2 * margin, 0), poses[:, 4]])
+              for poses in (start, end)]
+    toi = time_of_impact(shrunk[0][first], shrunk[1][first], shrunk[0][second], shrunk[1][second])
+    hit = toi <= 1
+    first, second, toi = first[hit], second[hit], toi[hit]
+    areas = overlap_areas(_corners_at(start[first], end[first], toi), _corners_at(start[second], end[second], toi))
+    return [(int(i), int(j), float(t), float(area)) for i, j, t, area in zip(first, second, toi, areas)]
+
@@ -0,0 +1,74 @@
+import numpy as np
+
+from util import find_smallest_rotations
+
+# Per car kinematic state, stored as one array per field across the whole fleet
+FLEET_FIELDS = ('x', 'y', 'old_x', 'old_y', 'dx', 'dy', 'd2x', 'd2y', 'v', 'old_v', 'heading', 'old_heading', 'side_slip',
+                'tpx', 's', 'd', 'l', 'w')
+
+
+class FleetField:
+    # CarState attribute that reads and writes the car's slot in its fleet's array
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, state, owner=None):
+        if state is None:
+            return self
+        return getattr(state.fleet, self.name)[state.slot]
+
+    def __set__(self, state, value):
+        getattr(state.fleet, self.name)[state.slot] = value
+        state.fleet.version[state.slot] += 1
+
+
+class FleetState:
+    """
+    Struct-of-arrays state of every car on a track. Each CarState is a view of one slot, so the kinematic update can be
+    applied to many cars at once. version counts the updates of each slot, so caches of values derived from a car's
+    state know when they are stale.
+    """
+    def __init__(self, track, capacity=8):
+        self.track = track
+        self.size = 0
+        for name in FLEET_FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=int if name == 'tpx' else float))
+        self.version = np.zeros(capacity, dtype=np.int64)
+
+    def add(self):
+        if self.size == len(self.x):
+            for name in FLEET_FIELDS + ('version',):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate((array, np.zeros_like(array))))
+        self.size += 1
+        return self.size - 1
+
+    def relocate(self, slots):
+        # Updates the track position of the cars in slots from their x and y
+        self.tpx[slots], self.s[slots], self.d[slots] = self.track.locate(self.tpx[slots], self.x[slots], self.y[slots])
+        self.version[slots] += 1
+
+    def bicycle_step(self, slots, lr, lf, time_step):
+        """
+        Kinematic bicycle update of InputModeCarState for the cars in slots, whose mode was just switched, i.e. whose v
+        and heading already hold the new mode and old_v and old_heading the previous one. Returns the accelerations and
+        steering angles of those cars.
+        """
+        slots, lr, lf = np.asarray(slots, dtype=int), np.asarray(lr, dtype=float), np.asarray(lf, dtype=float)
+        v, old_v, heading, old_heading = self.v[slots], self.old_v[slots], self.heading[slots], self.old_heading[slots]
+        side_slip, dx, dy = self.side_slip[slots], self.dx[slots], self.dy[slots]
+        acceleration = (v - old_v) / time_step
+        turning = np.abs(heading - old_heading) > 1e-6
+        dh = np.where(turning, find_smallest_rotations(heading, old_heading) / time_step, 0)
+        avg_v = (v + old_v) / 2
+        steering_angle = np.arctan(dh * (lr + lf) / (avg_v * np.cos(side_slip)))
+        new_dx = v * np.cos(heading + side_slip)
+        new_dy = v * np.sin(heading + side_slip)
+        self.old_x[slots], self.old_y[slots] = self.x[slots], self.y[slots]
+        self.x[slots] += (new_dx + dx) * time_step * 0.5
+        self.y[slots] += (new_dy + dy) * time_step * 0.5
+        self.d2x[slots], self.d2y[slots] = (new_dx - dx) / time_step, (new_dy - dy) / time_step
+        self.dx[slots], self.dy[slots] = new_dx, new_dy
+        self.side_slip[slots] = np.arctan(lr * np.tan(steering_angle) / (lr + lf))
+        self.relocate(slots)
+        return acceleration, steering_angle
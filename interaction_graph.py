@@ -0,0 +1,113 @@
+import math
+
+import numpy as np
+
+from util import rect_from_center, generate_heading_sweep, stack_corners
+
+
+class InteractionGraph:
+    """
+    Persistent ahead/side neighbours of the cars on a track. Cars are hashed into buckets of bucket_size track points
+    by their position on the lap, so a car is only tested against the cars in the buckets its heading sweep can reach,
+    whatever lap they are on. Updates are incremental: only the cars that moved since the last update, and the cars
+    around them, are reconnected.
+    """
+    def __init__(self, track, bucket_size=10):
+        self.track = track
+        self.bucket_size = bucket_size
+        # tpx keeps counting up across laps, while the buckets wrap around with the track
+        self.lap = len(track.center_coords)
+        # Shortest distance between consecutive center points, so that a reach in meters bounds a reach in track points
+        self.spacing = float(np.min(track.segment_length))
+        self.cars = []
+        self.slots = {}
+        self.buckets = {}
+        self.keys = {}
+        self.ahead = {}
+        self.side = {}
+        self.neighbor_cars = {}
+        self.time_step = None
+
+    def add(self, car):
+        self.slots[car] = len(self.cars)
+        self.cars.append(car)
+        self.ahead[car] = []
+        self.side[car] = []
+        self.neighbor_cars[car] = []
+
+    def neighbors(self, car):
+        # Cars beside or ahead of car, i.e. the opponents it has to consider
+        return self.neighbor_cars[car]
+
+    def _key(self, car):
+        return car.state.tpx, car.state.s, car.state.x, car.state.y, car.state.v, car.state.heading
+
+    def _rank(self, car):
+        # Same order as Track.get_car_ordering, which keeps insertion order between otherwise equal cars
+        return car.state.s, car.state.v, -self.slots[car]
+
+    def _bucket(self, tpx):
+        return math.floor(tpx % self.lap / self.bucket_size)
+
+    def _cars_between(self, low_tpx, high_tpx):
+        # Cars on any lap within the center points low_tpx..high_tpx, which may run over the start/finish line
+        last = self._bucket(self.lap - 1)
+        if high_tpx - low_tpx + 1 >= self.lap:
+            buckets = range(last + 1)
+        elif low_tpx % self.lap <= high_tpx % self.lap:
+            buckets = range(self._bucket(low_tpx), self._bucket(high_tpx) + 1)
+        else:
+            buckets = [*range(self._bucket(low_tpx), last + 1), *range(self._bucket(high_tpx) + 1)]
+        for bucket in buckets:
+            yield from self.buckets.get(bucket, ())
+
+    def _reach(self, car, time_step, opponent_radius):
+        # Track points between car and the furthest opponent center its sweep, which starts at the front of the car, can touch
+        sweep_radius = max(car.state.v * time_step, car.state.w / 2)
+        return math.ceil((car.state.l / 2 + sweep_radius + opponent_radius) / self.spacing) + 1
+
+    def _connect(self, car, time_step, opponent_radius):
+        rank = self._rank(car)
+        tpx = car.state.tpx
+        side, candidates = [], []
+        # Cars are ranked by s, so a car ranked ahead can be behind in tpx, by a few center points or by a lap
+        reach = max(self._reach(car, time_step, opponent_radius), self.bucket_size)
+        nearby = self._cars_between(tpx - reach, tpx + reach)
+        for other in sorted(nearby, key=self._rank, reverse=True):
+            if other is car or self._rank(other) <= rank:
+                continue
+            if other.state.tpx == tpx:
+                side.append(other)
+            else:
+                candidates.append(other)
+        ahead = []
+        if candidates:
+            boxes = [rect_from_center(o.state.x, o.state.y, o.state.l, o.state.w, o.state.heading) for o in candidates]
+            hits = generate_heading_sweep(car, time_step).intersects_boxes(stack_corners(boxes))
+            ahead = [other for other, hit in zip(candidates, hits) if hit]
+        self.side[car] = [other.state for other in side]
+        self.ahead[car] = [other.state for other in ahead]
+        self.neighbor_cars[car] = side + ahead
+
+    def update(self, time_step):
+        if time_step != self.time_step:
+            moved = list(self.cars)
+            self.time_step = time_step
+        else:
+            moved = [car for car in self.cars if self.keys.get(car) != self._key(car)]
+        if not moved:
+            return
+        opponent_radius = max(math.hypot(car.state.l, car.state.w) / 2 for car in self.cars)
+        reach = max(max(self._reach(car, time_step, opponent_radius) for car in self.cars), self.bucket_size)
+        stale = set(moved)
+        for car in moved:
+            old = self.keys.get(car)
+            if old is not None:
+                self.buckets[self._bucket(old[0])].remove(car)
+                stale.update(self._cars_between(old[0] - reach, old[0] + reach))
+            key = self._key(car)
+            self.keys[car] = key
+            self.buckets.setdefault(self._bucket(key[0]), set()).add(car)
+            stale.update(self._cars_between(key[0] - reach, key[0] + reach))
+        for car in stale:
+            self._connect(car, time_step, opponent_radius)
@@ -0,0 +1,84 @@
+from pathos.helpers import mp
+
+from car_models import Car
+from track import Track
+
+# Static car attributes the optimizers read. They are shipped to the workers once, when the pool starts.
+PLANNING_ATTRIBUTES = ('max_vel', 'acc_profile', 'width', 'length', 'max_gs', 'max_steering_angle', 'max_acceleration',
+                       'max_braking', 'control_type', 'control_params')
+
+_worker_cars = []
+
+
+class CarStateSnapshot:
+    __slots__ = ('x', 'y', 'dx', 'dy', 'd2x', 'd2y', 'v', 'heading', 'side_slip', 'tpx', 's', 'd', 'l', 'w')
+
+    def __init__(self, state):
+        for attribute in self.__slots__:
+            setattr(self, attribute, getattr(state, attribute))
+
+
+class PlanningCar(Car):
+    def __init__(self, attributes, track):
+        for attribute, value in zip(PLANNING_ATTRIBUTES, attributes):
+            setattr(self, attribute, value)
+        self.track = track
+        self.state = None
+
+
+def _init_worker(track, car_attributes):
+    global _worker_cars
+    if isinstance(track, str):
+        track = Track.load(track)
+    _worker_cars = [PlanningCar(attributes, track) for attributes in car_attributes]
+
+
+def _plan_car(request):
+    car_id, opponent_ids, snapshots, replan_time, input_update_time = request
+    for i, snapshot in snapshots.items():
+        _worker_cars[i].state = snapshot
+    agent = _worker_cars[car_id]
+    return car_id, agent.plan_optimal_trajectory([_worker_cars[i] for i in opponent_ids], replan_time, input_update_time)
+
+
+def planning_cost(car, num_opponents):
+    # Rough number of trajectory optimizations bezier_race_optimize runs for this car
+    level = car.control_params.get('optimizer_params', {}).get('level', 0)
+    if not num_opponents or level <= 0:
+        return 1
+    if level == 1:
+        return num_opponents + 1
+    return 2 * num_opponents + 2
+
+
+class PlanningService:
+    """
+    Long-lived pool of planning workers. Each worker receives the track and the static attributes of every car once
+    at startup, after which every round only ships compact state snapshots of the planning car and its opponents.
+    A track saved as an asset is shipped as its path, so the workers memory-map it instead of unpickling a copy.
+    """
+    def __init__(self, track, cars, processes):
+        self.cars = cars
+        self.car_ids = {car: i for i, car in enumerate(cars)}
+        car_attributes = [tuple(getattr(car, attribute) for attribute in PLANNING_ATTRIBUTES) for car in cars]
+        self.pool = mp.Pool(processes=processes, initializer=_init_worker,
+                            initargs=(track.asset_path or track.without_vehicles(), car_attributes))
+
+    def plan(self, opponents, replan_time, input_update_time):
+        # opponents[i] holds the cars that car i should consider while planning
+        snapshots = [CarStateSnapshot(car.state) for car in self.cars]
+        requests = []
+        for car_id, car_opponents in enumerate(opponents):
+            opponent_ids = [self.car_ids[o] for o in car_opponents]
+            requests.append((car_id, opponent_ids, {i: snapshots[i] for i in [car_id] + opponent_ids},
+                             replan_time, input_update_time))
+        # Hand out the most expensive cars first, one at a time, so that idle workers keep picking up the rest
+        requests.sort(key=lambda r: planning_cost(self.cars[r[0]], len(r[1])), reverse=True)
+        actions = [None] * len(self.cars)
+        for car_id, car_actions in self.pool.imap_unordered(_plan_car, requests, chunksize=1):
+            actions[car_id] = car_actions
+        return actions
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
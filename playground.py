@@ -91,4 +91,4 @@ our_rects =  [rect_from_center(x, y, 5, 2, h) for x, y, h in zip(map(x_pos_f, np
                                                                                map(h_pos_f, np.linspace(0, dt)))]
 
 for ours, theirs in zip(our_rects, adversary_rects):
-    print(ours.intersection(theirs).area)
+    print(ours.intersection_area(theirs))
@@ -0,0 +1,83 @@
+import contextlib
+import io
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from scipy.optimize import approx_fprime
+
+from bezier_optimizer import BezierCar
+from car_profiles import f1_profile
+from track_data import main_track
+
+
+@pytest.fixture(scope='module')
+def track():
+    return main_track()
+
+
+def _bezier_car(track, point, speed=30.):
+    # BezierCar for an f1 car on center point `point`, driving along the track
+    x, y = track.center_coords[point]
+    tx, ty = track.tangent[point]
+    agent = SimpleNamespace(
+        control_params={'optimizer_params': {'min_point_horizon': 25, 'max_point_horizon': 150, 'bezier_order': 6,
+                                             'plan_time_horizon': 5, 'plan_time_precision': .1, 'level': 1}},
+        state=SimpleNamespace(tpx=point, x=x, y=y, dx=speed * tx, dy=speed * ty, d2x=-2 * ty, d2y=2 * tx),
+        max_gs=f1_profile['max_cornering_gs'], max_steering_angle=f1_profile['max_steering_angle'],
+        acc_profile=f1_profile['acceleration_profile'], max_braking=-f1_profile['max_braking'],
+        max_vel=f1_profile['max_velocity'], width=f1_profile['car_width'], length=f1_profile['car_length'], track=track)
+    car = BezierCar(agent)
+    with contextlib.redirect_stdout(io.StringIO()):
+        car.prep_control_points()
+    return car
+
+
+def _random_points(car, count, seed):
+    # Control point vectors around the initial guess, keeping the point horizon fixed
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        c = car.initial.copy()
+        c[:-1] += rng.normal(0, 3, len(c) - 1)
+        yield c
+
+
+def _assert_matches_differences(function, derivative, c):
+    numeric = approx_fprime(c, function, 1e-6)
+    analytic = np.asarray(derivative(c))
+    assert analytic.shape == numeric.shape
+    assert np.allclose(analytic, numeric, rtol=1e-3, atol=1e-4 * max(1, np.abs(numeric).max()))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_speed_jacobian(track, seed):
+    car = _bezier_car(track, 100)
+    _, constraints = car.objective_and_constraints([])
+    speed = constraints[0]
+    for c in _random_points(car, 10, seed):
+        _assert_matches_differences(speed.fun, speed.jac, c)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_steering_jacobian(track, seed):
+    car = _bezier_car(track, 100)
+    _, constraints = car.objective_and_constraints([])
+    steering = constraints[1]
+    for c in _random_points(car, 10, seed):
+        _assert_matches_differences(steering.fun, steering.jac, c)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('with_opponent', [False, True])
+def test_objective_gradient(track, seed, with_opponent):
+    car = _bezier_car(track, 100)
+    opponents = []
+    if with_opponent:
+        # Close enough ahead that the separation penalty is active along part of the plan
+        opponent = _bezier_car(track, 103, speed=25.)
+        opponent.final_cp = opponent.initial
+        opponents.append(opponent)
+    opt, _ = car.objective_and_constraints(opponents)
+    for c in _random_points(car, 10, seed):
+        _assert_matches_differences(lambda c: opt(c)[0], lambda c: opt(c)[1], c)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from bezier_util import bernstein_basis, bezier_acceleration, bezier_arc_length, bezier_evaluate, bezier_speed, \
+    bezier_trajectory, plan_basis
+
+
+def _comb_evaluate(c, taus, order, horizon):
+    # Position, velocity and acceleration one tau at a time, with the comb-based formulas
+    position = [bezier_trajectory(c, tau, order, horizon) for tau in taus]
+    velocity = [bezier_speed(c, tau, order, horizon) for tau in taus]
+    acceleration = [bezier_acceleration(c, tau, order, horizon) for tau in taus] if order >= 2 else [0.] * len(taus)
+    return np.array(position), np.array(velocity), np.array(acceleration)
+
+
+@pytest.mark.parametrize('order', range(1, 9))
+def test_bezier_evaluate_matches_comb(order):
+    rng = np.random.default_rng(order)
+    horizon = 5.
+    taus = tuple(np.sort(rng.uniform(0, horizon, 30)))
+    cx, cy = rng.uniform(0, 500, (2, order + 1))
+    position, velocity, acceleration = bezier_evaluate(cx, cy, taus, order, horizon)
+    for axis, c in enumerate((cx, cy)):
+        expected = _comb_evaluate(c, taus, order, horizon)
+        for got, want in zip((position[:, axis], velocity[:, axis], acceleration[:, axis]), expected):
+            assert np.allclose(got, want, rtol=1e-12, atol=1e-9)
+
+
+def test_bernstein_basis_is_cached_and_read_only():
+    first = bernstein_basis(6, (0., 1., 2.5), 5.)
+    assert bernstein_basis(6, (0., 1., 2.5), 5.) is first
+    with pytest.raises(ValueError):
+        first[0][0, 0] = 1.
+
+
+@pytest.mark.parametrize('order, horizon, delta', [(6, 5, .1), (4, 3, .25), (6, 2, .3)])
+def test_plan_basis_matches_comb(order, horizon, delta):
+    taus, position, velocity, acceleration = plan_basis(order, horizon, delta)
+    # Samples every delta from 0, the last one snapped to the horizon
+    assert taus[0] == 0 and taus[-1] == horizon
+    assert np.allclose(np.diff(taus[:-1]), delta)
+    assert 0 < horizon - taus[-2] <= delta + 1e-9
+    c = np.random.default_rng(0).uniform(0, 500, order + 1)
+    for got, want in zip((position @ c, velocity @ c, acceleration @ c), _comb_evaluate(c, taus, order, horizon)):
+        assert np.allclose(got, want, rtol=1e-12, atol=1e-9)
+
+
+def test_arc_length_matches_polyline():
+    rng = np.random.default_rng(3)
+    cx, cy = rng.uniform(0, 500, (2, 7))
+    taus = np.linspace(0, 5, 101)
+    points = np.array([[bezier_trajectory(cx, tau, 6, 5), bezier_trajectory(cy, tau, 6, 5)] for tau in taus])
+    expected = np.sum(np.hypot(*np.diff(points, axis=0).T))
+    assert bezier_arc_length(cx, cy, time_horizon=5) == pytest.approx(expected, rel=1e-12)
@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+import car_modes
+from car_modes import InputModes, max_accelerations, save_transition_tables, set_transition_table_dir, \
+    transition_table
+from util import TPI
+
+
+@pytest.fixture(autouse=True)
+def fresh_tables(monkeypatch):
+    # Tables are shared per profile at module level, so every test starts without any
+    monkeypatch.setattr(car_modes, '_transition_tables', {})
+    monkeypatch.setattr(car_modes, '_transition_table_dir', None)
+
+
+def _modes():
+    return InputModes(10, -20, 2, 80, 40, vel_precision=.5, heading_precision=.01)
+
+
+def _switches(modes, count, seed):
+    # On-grid switches from random modes, to nearby and to arbitrary velocities and headings
+    rng = np.random.default_rng(seed)
+    for k in range(count):
+        mode = modes.mode_from_velocity_heading(rng.uniform(0, 80), rng.uniform(0, TPI))
+        v = rng.uniform(0, 80) if k % 2 else mode[0] + rng.choice([-1, 0, 1]) * modes.v_prec
+        yield mode, modes.mode_from_velocity_heading(v, (mode[1] + rng.uniform(-.3, .3)) % TPI)
+
+
+def _direct(modes, mode, target, dt):
+    return int(modes.limit_flags(*max_accelerations(mode[0], mode[1], target[0], target[1], dt)))
+
+
+@pytest.mark.parametrize('dt', [.1, .5])
+def test_table_matches_direct_flags(dt):
+    modes = _modes()
+    table = transition_table(modes, dt)
+    for mode, target in _switches(modes, 2000, 0):
+        flags = table.limits(mode, *target)
+        assert flags is not None
+        assert flags == _direct(modes, mode, target, dt) == modes.transition_limits(mode, *target, dt)
+
+
+def test_off_grid_switches_fall_back_to_direct_flags():
+    modes = _modes()
+    table = transition_table(modes, .1)
+    rng = np.random.default_rng(1)
+    for mode, target in _switches(modes, 200, 1):
+        for off_grid in [(target[0] + .123, target[1]), (target[0], target[1] + .0031), (modes.max_v + 1, target[1])]:
+            assert table.limits(mode, *off_grid) is None
+            assert modes.transition_limits(mode, *off_grid, .1) == _direct(modes, mode, off_grid, .1)
+        off_mode = (mode[0] + rng.uniform(.01, .49), mode[1])
+        assert table.limits(off_mode, *target) is None
+        assert modes.transition_limits(off_mode, *target, .1) == _direct(modes, off_mode, target, .1)
+    # The fallback never builds rows
+    assert not table.rows
+
+
+def test_tables_round_trip_through_table_dir(tmp_path):
+    set_transition_table_dir(str(tmp_path))
+    modes = _modes()
+    switches = list(_switches(modes, 300, 2))
+    expected = [modes.transition_limits(mode, *target, .1) for mode, target in switches]
+    table = transition_table(modes, .1)
+    built = set(table.new_rows)
+    save_transition_tables()
+    assert os.path.exists(table.path) and not table.new_rows
+
+    # A fresh table, e.g. in the next run, reads its rows from the file instead of building them
+    car_modes._transition_tables.clear()
+    loaded = transition_table(modes, .1)
+    assert loaded is not table and loaded.path == table.path
+    assert [modes.transition_limits(mode, *target, .1) for mode, target in switches] == expected
+    assert set(loaded.rows) == built and not loaded.new_rows
+
+    # Rows built later are added to the file next to the stored ones
+    more = list(_switches(modes, 50, 3))
+    for mode, target in more:
+        modes.transition_limits(mode, *target, .1)
+    added = set(loaded.new_rows)
+    save_transition_tables()
+    car_modes._transition_tables.clear()
+    assert transition_table(modes, .1)._stored_names == {f"row_{i}_{j}" for i, j in built | added}
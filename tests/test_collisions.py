@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from collisions import box_corners, box_distances, boxes_intersect, find_collisions, find_swept_collisions, \
+    overlap_areas, time_of_impact
+from util import OrientedBox
+
+
+def _random_boxes(rng, count, extent):
+    return [OrientedBox(*rng.uniform(0, extent, 2), rng.uniform(1, 5), rng.uniform(1, 3), rng.uniform(-4, 4))
+            for _ in range(count)]
+
+
+def test_batched_kernels_match_shapely():
+    rng = np.random.default_rng(1)
+    first, second = _random_boxes(rng, 40, 8), _random_boxes(rng, 50, 8)
+    second[:5] = first[:5]
+    # Every box of first against every box of second in one broadcast call
+    corners1 = np.stack([box.corners() for box in first])[:, None]
+    corners2 = np.stack([box.corners() for box in second])[None, :]
+    intersects, areas = boxes_intersect(corners1, corners2), overlap_areas(corners1, corners2)
+    assert intersects.shape == areas.shape == (40, 50)
+    for i, a in enumerate(first):
+        for j, b in enumerate(second):
+            assert intersects[i, j] == a.polygon().intersects(b.polygon())
+            assert areas[i, j] == pytest.approx(a.polygon().intersection(b.polygon()).area, abs=1e-9)
+
+
+def test_find_collisions_matches_all_pairs():
+    boxes = _random_boxes(np.random.default_rng(2), 60, 30)
+    expected = [(i, j) for i in range(len(boxes)) for j in range(i + 1, len(boxes))
+                if boxes[i].polygon().intersection(boxes[j].polygon()).area > .5]
+    assert sorted((i, j) for i, j, _ in find_collisions(boxes)) == expected
+
+
+def test_pass_through_is_caught():
+    # A car at 100 m/s passes through a stopped one within a 0.1 s step and ends clear of it
+    start = [OrientedBox(0, 0, 5, 2, 0), OrientedBox(5, 0.3, 4.5, 2, 0)]
+    end = [OrientedBox(10, 0, 5, 2, 0), OrientedBox(5, 0.3, 4.5, 2, 0)]
+    assert find_collisions(end) == []
+    (i, j, toi, area), = find_swept_collisions(start, end)
+    assert (i, j) == (0, 1)
+    assert 0 < toi < .5
+    assert area > 0
+
+
+@pytest.mark.parametrize('motion', [10, 30, 100, 1000])
+def test_graze_is_not_a_collision(motion):
+    # 2 m wide cars 1.95 m apart never touch once shrunk by the margin, however far they move past each other
+    start = [OrientedBox(0, 0, 5, 2, 0), OrientedBox(motion / 2, 1.95, 5, 2, 0)]
+    end = [OrientedBox(motion, 0, 5, 2, 0), OrientedBox(motion / 2, 1.95, 5, 2, 0)]
+    assert find_swept_collisions(start, end) == []
+
+
+@pytest.mark.parametrize('gap, hit', [(.0005, True), (.0015, False), (.15, False)])
+def test_contact_within_tolerance(gap, hit):
+    poses = [np.array([pose], dtype=float) for pose in
+             ([0, 0, 5, 2, 0], [50, 0, 5, 2, 0], [25, 2 + gap, 5, 2, 0], [25, 2 + gap, 5, 2, 0])]
+    assert np.isfinite(time_of_impact(*poses)[0]) == hit
+
+
+def test_time_of_impact_matches_dense_sampling():
+    rng = np.random.default_rng(4)
+    times = np.linspace(0, 1, 2001)
+
+    def sweep(start, end):
+        turn = (end[4] - start[4] + np.pi) % (2 * np.pi) - np.pi
+        return box_corners(start[0] + times * (end[0] - start[0]), start[1] + times * (end[1] - start[1]),
+                           start[2], start[3], start[4] + times * turn)
+
+    contacts = 0
+    for _ in range(200):
+        start = np.column_stack([rng.uniform(0, 12, (2, 2)), rng.uniform(3, 5, 2), rng.uniform(1.5, 2.2, 2),
+                                 rng.uniform(-3, 3, 2)])
+        end = start + np.column_stack([rng.uniform(-10, 10, (2, 2)), np.zeros((2, 2)), rng.uniform(-.5, .5, 2)])
+        toi = time_of_impact(start[:1], end[:1], start[1:], end[1:])[0]
+        distances = box_distances(sweep(start[0], end[0]), sweep(start[1], end[1]))
+        if np.isfinite(toi):
+            contacts += 1
+            first = times[np.argmax(distances <= 2e-3)]
+            assert distances.min() <= 2e-3
+            assert abs(toi - first) <= 1e-3
+        else:
+            assert distances.min() > 1e-3 / 2
+    assert contacts > 20
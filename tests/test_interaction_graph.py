@@ -0,0 +1,100 @@
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from interaction_graph import InteractionGraph
+from track_data import main_track
+from util import generate_heading_sweep, rect_from_center
+
+
+class _Car:
+    def __init__(self, **state):
+        self.state = SimpleNamespace(**state)
+
+
+@pytest.fixture(scope='module')
+def track():
+    return main_track()
+
+
+def _car_at(track, point, lap=0, offset=0., v=30., l=5., w=2., turn=0.):
+    # Car on center point `point` of lap `lap`, pointing along the track, or turn off it
+    n = len(track.center_coords)
+    x, y = track.center_coords[point % n] + offset * track.normal[point % n]
+    heading = math.atan2(track.tangent[point % n, 1], track.tangent[point % n, 0]) + turn
+    return _Car(tpx=point + lap * n, s=track.arc_length[point % n] + lap * track.track_length, x=x, y=y, v=v,
+                heading=heading, l=l, w=w)
+
+
+def _graph(track, cars, time_step=.5):
+    graph = InteractionGraph(track)
+    for car in cars:
+        graph.add(car)
+    graph.update(time_step)
+    return graph
+
+
+def _all_pairs(cars, time_step):
+    # Every car's sweep against every car ranked ahead of it, as before the bucketed graph
+    ranked = sorted(cars, key=lambda car: (car.state.s, car.state.v, -cars.index(car)), reverse=True)
+    ahead, side = {}, {}
+    for i, car in enumerate(ranked):
+        sweep = generate_heading_sweep(car, time_step).polygon(num_segments=20000)
+        side[car] = [other.state for other in ranked[:i] if other.state.tpx == car.state.tpx]
+        ahead[car] = [other.state for other in ranked[:i] if other.state.tpx != car.state.tpx and sweep.intersects(
+            rect_from_center(other.state.x, other.state.y, other.state.l, other.state.w, other.state.heading).polygon())]
+    return ahead, side
+
+
+@pytest.mark.parametrize('lap', [0, 1, 2])
+def test_car_ahead_on_any_lap(track, lap):
+    a, b = _car_at(track, 100), _car_at(track, 107, lap=lap)
+    graph = _graph(track, [a, b])
+    assert graph.ahead[a] == [b.state]
+    assert graph.ahead[b] == graph.side[a] == []
+
+
+@pytest.mark.parametrize('lap', [0, 1])
+def test_car_ahead_across_start_finish(track, lap):
+    n = len(track.center_coords)
+    a, b = _car_at(track, n - 4, lap=lap), _car_at(track, 3, lap=lap + 1)
+    graph = _graph(track, [a, b])
+    assert graph.ahead[a] == [b.state]
+
+
+def test_lapping_car_moves_in_and_out(track):
+    a, b = _car_at(track, 100), _car_at(track, 400)
+    graph = _graph(track, [a, b])
+    assert graph.ahead[a] == []
+    # b comes round a lap later to just ahead of a, then leaves again
+    b.state = _car_at(track, 105, lap=1).state
+    graph.update(.5)
+    assert graph.ahead[a] == [b.state]
+    b.state = _car_at(track, 400, lap=1).state
+    graph.update(.5)
+    assert graph.ahead[a] == []
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_all_pairs_over_laps(track, seed):
+    rng = np.random.default_rng(seed)
+    n = len(track.center_coords)
+    cars = [_car_at(track, int(rng.integers(-40, 40)) % n, lap=int(rng.integers(3)), offset=rng.uniform(-4, 4),
+                    v=rng.uniform(0, 60), l=rng.choice([4, 4.5, 5]), w=rng.choice([1.8, 2]), turn=rng.uniform(-.5, .5))
+            for _ in range(30)]
+    graph = InteractionGraph(track)
+    for car in cars:
+        graph.add(car)
+    for step in range(10):
+        for i in rng.choice(len(cars), 10, replace=False):
+            lap, point = divmod(cars[i].state.tpx + int(rng.integers(0, 4)), n)
+            cars[i].state = _car_at(track, point, lap=lap, offset=rng.uniform(-4, 4), v=rng.uniform(0, 60),
+                                    l=cars[i].state.l, w=cars[i].state.w, turn=rng.uniform(-.5, .5)).state
+        time_step = .1 if step % 5 == 0 else .5
+        graph.update(time_step)
+        ahead, side = _all_pairs(cars, time_step)
+        for car in cars:
+            assert graph.ahead[car] == ahead[car]
+            assert graph.side[car] == side[car]
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from track_data import main_track
+
+
+@pytest.fixture(scope='module')
+def track():
+    return main_track()
+
+
+def _frenet_near(track, s, xs, ys):
+    # to_frenet searched from a few center points before the arc length the positions were made from
+    n = len(track.center_coords)
+    init_px = (np.searchsorted(track.arc_length, np.mod(s, track.track_length)) - 10) % n
+    return track.to_frenet(xs, ys, init_px=init_px, point_horizon=30)
+
+
+def test_centerline_moves_forward(track):
+    vector = track.segment_vector
+    assert np.all(track.segment_length > 0)
+    assert np.all(np.sum(np.roll(vector, 1, axis=0) * vector, axis=1) >= 0)
+    # The frame is only invertible within the tightest radius
+    assert 1 / np.max(np.abs(track.curvature)) > track.width / 2
+
+
+def test_frenet_round_trip(track):
+    rng = np.random.default_rng(0)
+    s = rng.uniform(0, track.track_length, 5000)
+    d = rng.uniform(-track.width / 2 + 1, track.width / 2 - 1, 5000)
+    s2, d2 = _frenet_near(track, s, *track.from_frenet(s, d))
+    ds = np.mod(s2 - s + track.track_length / 2, track.track_length) - track.track_length / 2
+    assert np.max(np.abs(ds)) < 1e-9
+    assert np.max(np.abs(d2 - d)) < 1e-9
+
+
+@pytest.mark.parametrize('d', [-4, -2, 0, 2, 4])
+def test_s_continuous_across_start_finish(track, d):
+    s = np.linspace(track.track_length - 30, track.track_length + 30, 2001)
+    xs, ys = track.from_frenet(s, np.full_like(s, d))
+    s2, _ = track.to_frenet(xs, ys, init_px=len(track.center_coords) - 40, point_horizon=80)
+    assert np.allclose(np.diff(s2), s[1] - s[0], atol=1e-9)
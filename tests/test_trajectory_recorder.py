@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from trajectory_recorder import TRAJECTORY_DTYPE, TrajectoryRecorder, car_records, load_trajectory
+
+
+def _rows(num_cars, steps):
+    rng = np.random.default_rng(0)
+    rows = np.zeros(num_cars * steps, dtype=TRAJECTORY_DTYPE)
+    rows['car'] = np.tile(np.arange(num_cars), steps)
+    rows['time'] = np.repeat(np.arange(steps) * .1, num_cars)
+    for name in TRAJECTORY_DTYPE.names[2:]:
+        rows[name] = rng.normal(size=len(rows))
+    return rows
+
+
+def _record(recorder, rows):
+    for row in rows:
+        recorder.record(*row.tolist())
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+def test_empty_recording(tmp_path, on_disk):
+    recorder = TrajectoryRecorder(2, path=str(tmp_path / 'empty.npy') if on_disk else None)
+    records = recorder.records()
+    assert records.dtype == TRAJECTORY_DTYPE and len(records) == 0
+    recorder.close()
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+def test_round_trip(tmp_path, on_disk):
+    path = str(tmp_path / 'run.npy') if on_disk else None
+    # Several full chunks and a partial one
+    rows = _rows(3, 50)
+    recorder = TrajectoryRecorder(3, path=path, chunk_size=16)
+    _record(recorder, rows)
+    assert np.array_equal(recorder.records(), rows)
+    assert np.array_equal(recorder.last, rows[-3:])
+    recorder.close()
+    if on_disk:
+        records = load_trajectory(path)
+        assert isinstance(records, np.memmap)
+        assert np.array_equal(records, rows)
+        for car in range(3):
+            assert np.array_equal(car_records(records, car), rows[rows['car'] == car])
+
+
+def test_readable_while_recording(tmp_path):
+    path = str(tmp_path / 'run.npy')
+    rows = _rows(2, 20)
+    recorder = TrajectoryRecorder(2, path=path, chunk_size=16)
+    _record(recorder, rows[:20])
+    # Only the flushed chunk is in the file so far
+    assert np.array_equal(load_trajectory(path), rows[:16])
+    _record(recorder, rows[20:])
+    recorder.close()
+    assert np.array_equal(load_trajectory(path), rows)
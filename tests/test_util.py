@@ -0,0 +1,93 @@
+import math
+
+import numpy as np
+import pytest
+
+from scipy import stats
+
+from util import HeadingSweep, OrientedBox, TruncatedNormalSampler, rect_from_center, stack_corners
+
+
+def _box_pairs(count, seed):
+    rng = np.random.default_rng(seed)
+    for k in range(count):
+        first = [*rng.uniform(0, 8, 2), rng.uniform(1, 5), rng.uniform(1, 3), rng.uniform(-4, 4)]
+        # Every tenth pair is two copies of the same box
+        second = first if k % 10 == 0 else [*rng.uniform(0, 8, 2), rng.uniform(1, 5), rng.uniform(1, 3),
+                                            rng.uniform(-4, 4)]
+        yield OrientedBox(*first), OrientedBox(*second)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_oriented_box_matches_shapely(seed):
+    for a, b in _box_pairs(500, seed):
+        pa, pb = a.polygon(), b.polygon()
+        assert a.intersects(b) == pa.intersects(pb)
+        assert np.allclose(a.bounds, pa.bounds, atol=1e-12)
+        assert a.intersection_area(b) == pytest.approx(pa.intersection(pb).area, abs=1e-9)
+
+
+def test_corners_follow_polygon():
+    box = rect_from_center(1, 2, 4, 2, np.pi / 2)
+    assert np.allclose(box.corners(), np.array(box.polygon().exterior.coords)[:4])
+    assert np.allclose(box.corners(), [[0, 4], [0, 0], [2, 0], [2, 4]])
+    assert box.polygon().area == pytest.approx(8)
+
+
+def _boxes_near_sweep(sweep, placement, count, rng):
+    # Boxes placed relative to the sweep, in its frame: anywhere around it, across the chord of its arc, or about
+    # its front edge and behind it
+    a = sweep.radius * math.cos(sweep.half_angle)
+    if placement == 'around':
+        f = rng.uniform(-3, sweep.radius + 3, count)
+    elif placement == 'chord':
+        f = a + rng.uniform(-.5, .5, count)
+    else:
+        f = rng.uniform(-4, .5, count)
+    l = rng.uniform(-sweep.radius - 3, sweep.radius + 3, count)
+    c, s = math.cos(sweep.heading), math.sin(sweep.heading)
+    return [OrientedBox(sweep.x + fi * c - li * s, sweep.y + fi * s + li * c, rng.uniform(.2, 5), rng.uniform(.2, 2),
+                        rng.uniform(-4, 4)) for fi, li in zip(f, l)]
+
+
+@pytest.mark.parametrize('placement', ['around', 'chord', 'behind'])
+@pytest.mark.parametrize('radius', [.4, 3, 30])
+def test_heading_sweep_matches_shapely(radius, placement):
+    rng = np.random.default_rng(int(radius * 10) + len(placement))
+    # A radius under the half width makes the trapezoid narrow towards the arc
+    sweep = HeadingSweep(10, -5, rng.uniform(-4, 4), radius, 1)
+    boxes = _boxes_near_sweep(sweep, placement, 300, rng)
+    polygon = sweep.polygon(num_segments=20000)
+    hits = sweep.intersects_boxes(stack_corners(boxes))
+    expected = [polygon.intersects(box.polygon()) for box in boxes]
+    assert list(hits) == expected
+    assert [sweep.intersects(box) for box in boxes] == expected
+    # Both outcomes are exercised
+    assert 0 < sum(expected) < len(boxes)
+
+
+def test_sampler_is_reproducible_per_seed():
+    # Samplers spawned from the same seed draw the same stream, and siblings independent ones
+    first, second = np.random.SeedSequence(7).spawn(2)
+    again, _ = np.random.SeedSequence(7).spawn(2)
+    draws = [TruncatedNormalSampler(seed).sample(np.zeros(100), 1, -1, 2) for seed in (first, again, second)]
+    assert np.array_equal(draws[0], draws[1])
+    assert not np.array_equal(draws[0], draws[2])
+
+
+@pytest.mark.parametrize('mean, sd, low, high', [(0, 1, -1, 2), (5, 2, 6, 20), (0, 1, -10, -2), (3, .5, 0, 3)])
+def test_sampler_matches_truncated_normal(mean, sd, low, high):
+    samples = TruncatedNormalSampler(0).sample(np.full(20000, mean), sd, low, high)
+    assert samples.min() >= low and samples.max() <= high
+    reference = stats.truncnorm((low - mean) / sd, (high - mean) / sd, loc=mean, scale=sd)
+    assert stats.kstest(samples, reference.cdf).pvalue > 1e-3
+
+
+def test_sampler_far_tails():
+    # Intervals many standard deviations from the mean on either side stay inside their bounds
+    sampler = TruncatedNormalSampler(0)
+    above = sampler.sample(0, 1, [8, 20], [9, 30])
+    below = sampler.sample(0, 1, [-9, -30], [-8, -20])
+    assert np.all(np.isfinite(above)) and np.all(np.isfinite(below))
+    assert np.all((above >= [8, 20]) & (above <= [9, 30]))
+    assert np.all((below >= [-9, -30]) & (below <= [-8, -20]))
@@ -1,95 +1,290 @@
-import math
+import json
+import struct
 from copy import copy
-from functools import lru_cache
 
 import numpy as np
-import shapely.geometry as geom
+from scipy.spatial import cKDTree
 
-from bezier_util import dist
-from util import circ_slice, rect_from_center, generate_heading_sweep
+from fleet_state import FleetState
+from interaction_graph import InteractionGraph
+
+# Track asset layout: magic, little endian uint32 header length, JSON header, then every array in TRACK_ARRAYS as raw
+# C-ordered data starting at a multiple of ASSET_ALIGNMENT bytes
+ASSET_MAGIC = b'HRTRACK1'
+ASSET_ALIGNMENT = 64
+TANGENT_WINDOW = 5
+TRACK_ARRAYS = ('center_coords', 'segment_vector', 'segment_length_sq', 'segment_length', 'arc_length', 'tangent',
+                'normal', 'right_boundary', 'left_boundary', 'curvature')
+
+
+def _align(offset):
+    return -(-offset // ASSET_ALIGNMENT) * ASSET_ALIGNMENT
 
 
 class Track():
     def __init__(self, track_center_x, track_center_y, track_width):
-        self.center_x = track_center_x
-        self.center_y = track_center_y
         self.width = track_width
-        self.boundary1_x, self.boundary1_y = zip(*self._generate_right_boundary())
-        self.boundary2_x, self.boundary2_y = zip(*self._generate_left_boundary())
-        self.center_coords = np.array([*zip(self.center_x, self.center_y)])
-        self.line = geom.LineString(self.center_coords)
+        self.asset_path = None
+        self._preprocess(track_center_x, track_center_y)
+        self._finish()
+
+    def _finish(self):
+        # Views and indices over the arrays in TRACK_ARRAYS, shared by freshly built and loaded tracks
+        self.center_x, self.center_y = self.center_coords[:, 0], self.center_coords[:, 1]
+        self.segment_start = self.center_coords
+        self.boundary1_x, self.boundary1_y = self.right_boundary[:, 0], self.right_boundary[:, 1]
+        self.boundary2_x, self.boundary2_y = self.left_boundary[:, 0], self.left_boundary[:, 1]
+        self.center_index = cKDTree(self.center_coords)
+        self._reset_vehicles()
+
+    def save(self, path):
+        # Writes the preprocessed track as an asset that Track.load can memory-map
+        header = {'width': self.width, 'track_length': self.track_length, 'arrays': {}}
+        offset = 0
+        for name in TRACK_ARRAYS:
+            array = np.ascontiguousarray(getattr(self, name))
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+            offset = _align(offset + array.nbytes)
+        encoded = json.dumps(header).encode()
+        data_start = _align(len(ASSET_MAGIC) + 4 + len(encoded))
+        with open(path, 'wb') as f:
+            f.write(ASSET_MAGIC + struct.pack('<I', len(encoded)) + encoded)
+            for name in TRACK_ARRAYS:
+                f.seek(data_start + header['arrays'][name]['offset'])
+                f.write(np.ascontiguousarray(getattr(self, name)).tobytes())
+        self.asset_path = path
+
+    @classmethod
+    def load(cls, path):
+        """
+        Opens a track asset written by Track.save. The arrays are read-only memory maps, so processes that load the same
+        asset share its pages. Only the KD-tree over the center points is rebuilt.
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(ASSET_MAGIC)) != ASSET_MAGIC:
+                raise ValueError(f"{path} is not a track asset")
+            length, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length))
+        data_start = _align(len(ASSET_MAGIC) + 4 + length)
+        track = cls.__new__(cls)
+        track.width = header['width']
+        track.track_length = header['track_length']
+        track.asset_path = path
+        for name in TRACK_ARRAYS:
+            spec = header['arrays'][name]
+            setattr(track, name, np.memmap(path, dtype=np.dtype(spec['dtype']), mode='r',
+                                           offset=data_start + spec['offset'], shape=tuple(spec['shape'])))
+        track._finish()
+        return track
+
+    def _preprocess(self, track_center_x, track_center_y):
+        # All centerline geometry in one vectorized pass. The track is closed, so every array wraps around.
+        points = np.column_stack((np.asarray(track_center_x, dtype=float), np.asarray(track_center_y, dtype=float)))
+        # Digitized centerlines repeat points and step back, e.g. where the last point meets the first. Merge points that
+        # (nearly) repeat the next one and drop points where the centerline reverses, i.e. turns by more than 90 degrees,
+        # until every segment has a length and moves forward along the track. Of two consecutive reversing points, which
+        # enclose a segment that steps back, the first is dropped.
+        while len(points) > 3:
+            vector = np.roll(points, -1, axis=0) - points
+            length = np.hypot(vector[:, 0], vector[:, 1])
+            reverses = np.sum(np.roll(vector, 1, axis=0) * vector, axis=1) < 0
+            drop = (length <= 1e-3 * np.median(length)) | (reverses & ~np.roll(reverses, 1))
+            if not drop.any():
+                break
+            points = points[~drop]
+        self.center_coords = points
+        # Segment i runs from center point i to center point i + 1, wrapping around at the end of the track
+        self.segment_vector = np.roll(points, -1, axis=0) - points
+        self.segment_length_sq = np.sum(self.segment_vector ** 2, axis=1)
+        self.segment_length = np.sqrt(self.segment_length_sq)
+        self.arc_length = np.concatenate(([0], np.cumsum(self.segment_length[:-1])))
+        self.track_length = float(np.sum(self.segment_length))
+        # Unit tangent at each point along the chord between the center points TANGENT_WINDOW before and after it, which
+        # smooths out centerlines digitized on a grid. The normal points to the left of the tangent.
+        direction = self.segment_vector / self.segment_length[:, None]
+        window = max(1, min(TANGENT_WINDOW, (len(points) - 1) // 2))
+        tangent = np.roll(points, -window, axis=0) - np.roll(points, window, axis=0)
+        tangent_norm = np.hypot(tangent[:, 0], tangent[:, 1])
+        self.tangent = np.where(tangent_norm[:, None] > 1e-9, tangent / np.maximum(tangent_norm, 1e-9)[:, None], direction)
+        self.normal = np.column_stack((-self.tangent[:, 1], self.tangent[:, 0]))
+        self.right_boundary = points - self.normal * (self.width / 2)
+        self.left_boundary = points + self.normal * (self.width / 2)
+        # Signed curvature (positive when turning left) as the rate at which that smoothed tangent turns, by central
+        # differences over the adjacent segments
+        before, after = np.roll(self.tangent, 1, axis=0), np.roll(self.tangent, -1, axis=0)
+        turn = np.arctan2(before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0], np.sum(before * after, axis=1))
+        self.curvature = turn / (np.roll(self.segment_length, 1) + self.segment_length)
+
+    def _reset_vehicles(self):
         self.vehicles_on_track = []
-        self.cars_ahead = {}
-        self.cars_side = {}
-
-    def _generate_right_boundary(self):
-        for i in range(len(self.center_x)):
-            if i == len(self.center_y) - 1: break
-            dy = self.center_y[i+1] - self.center_y[i]
-            dx = self.center_x[i+1] - self.center_x[i]
-            dist = math.sqrt(dy ** 2 + dx ** 2)
-            arr = np.array([dx * math.cos(90) + dy * math.sin(90), -dx*math.sin(90) + dy*math.cos(90)])
-            arr = arr * (self.width/2)/dist
-            yield self.center_x[i] + arr[0], self.center_y[i]+arr[1]
-
-    def _generate_left_boundary(self):
-        for i in range(len(self.center_x)):
-            if i == len(self.center_y) - 1: break
-            dy = self.center_y[i+1] - self.center_y[i]
-            dx = self.center_x[i+1] - self.center_x[i]
-            dist = math.sqrt(dy ** 2 + dx ** 2)
-            arr = np.array([dx * math.cos(90) - dy * math.sin(90), dx*math.sin(90) + dy*math.cos(90)])
-            arr = arr * (self.width/2)/dist
-            yield self.center_x[i] + arr[0], self.center_y[i]+arr[1]
+        self.fleet = FleetState(self)
+        self.interactions = InteractionGraph(self)
+        self.cars_ahead = self.interactions.ahead
+        self.cars_side = self.interactions.side
+        # FootprintCache of the simulator running on this track, if any
+        self.footprints = None
 
     def find_pos_index(self, init_px, currx, curry, point_horizon=400):
-        min_dist = np.inf
-        min_idx = 999999
-        for i in range(init_px, init_px + point_horizon):
-            idx = i % len(self.center_x)
-            d = dist(self.center_x[idx], self.center_y[idx], currx, curry)
-            if d < min_dist:
-                min_dist = d
-                min_idx = i
-        return min_idx
+        return int(self.find_pos_indices(init_px, currx, curry, point_horizon)[0])
+
+    def find_pos_indices(self, init_px, xs, ys, point_horizon=400, candidates=8):
+        # Index of the closest centerline point within [init_px, init_px + point_horizon) for every (x, y). Indices
+        # are not wrapped, so they keep counting up across laps like the car's tpx does.
+        points = np.column_stack((np.ravel(xs), np.ravel(ys))).astype(float)
+        init_px = np.broadcast_to(np.asarray(init_px), (len(points),))
+        n = len(self.center_coords)
+        k = min(candidates, n)
+        dists, idxs = self.center_index.query(points, k=k)
+        dists, idxs = np.reshape(dists, (len(points), k)), np.reshape(idxs, (len(points), k))
+        offsets = (idxs - init_px[:, None]) % n
+        dists = np.where(offsets < point_horizon, dists, np.inf)
+        # Equal distances resolve to the earliest index in the window, as a linear scan would
+        best = np.lexsort((offsets, dists))[:, 0]
+        rows = np.arange(len(points))
+        result = init_px + offsets[rows, best]
+        for i in np.flatnonzero(~np.isfinite(dists[rows, best])):
+            # None of the nearest candidates are inside the window, so scan the window itself
+            window = (init_px[i] + np.arange(point_horizon)) % n
+            result[i] = init_px[i] + np.argmin(np.hypot(*(self.center_coords[window] - points[i]).T))
+        return result
+
+    def _frame(self, idx, t):
+        # Centerline point and unit normal at t along segment idx. The normal is interpolated between the normals at the
+        # ends of the segment, so the frame turns smoothly around every center point.
+        normal = self.normal[idx] + t[..., None] * (self.normal[(idx + 1) % len(self.center_coords)] - self.normal[idx])
+        return self.segment_start[idx] + t[..., None] * self.segment_vector[idx], normal / np.hypot(normal[..., 0], normal[..., 1])[..., None]
+
+    def _project_near_index(self, init_px, xs, ys, point_horizon, reach=3):
+        """
+        Projects every (x, y) along the interpolated normals onto the segments within reach of its closest center point
+        in the window. Returns those closest point indices, the unwrapped index of the segment projected onto, how far
+        along it the projection is (0 to 1), the signed lateral offset, positive to the left of the centerline, and the
+        gradient of that position along the segment with respect to (x, y).
+        """
+        cross = lambda a, b: a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+        index = self.find_pos_indices(init_px, xs, ys, point_horizon)
+        points = np.column_stack((np.ravel(xs), np.ravel(ys))).astype(float)
+        segments = index[:, None] + np.arange(-reach, reach)
+        idx = segments % len(self.center_coords)
+        vector, n0 = self.segment_vector[idx], self.normal[idx]
+        dn = self.normal[(idx + 1) % len(self.center_coords)] - n0
+        relative = points[:, None, :] - self.segment_start[idx]
+        # The point lies on the normal at t when cross(n0 + t dn, relative - t vector) = 0, a quadratic in t
+        qa, qb, qc = -cross(dn, vector), cross(dn, relative) - cross(n0, vector), cross(n0, relative)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            q = -0.5 * (qb + np.where(qb < 0, -1, 1) * np.sqrt(qb ** 2 - 4 * qa * qc))
+            roots = np.stack((q / qa, qc / q), axis=2)
+        roots = np.where((roots >= -1e-9) & (roots <= 1 + 1e-9), np.clip(roots, 0, 1), np.nan)
+        # Far inside tight corners no normal reaches the point, so fall back to the closest point on the segment
+        projected = np.clip(np.sum(relative * vector, axis=2) / self.segment_length_sq[idx], 0, 1)
+        roots = np.concatenate((roots, projected[:, :, None]), axis=2)
+        offset = relative[:, :, None, :] - roots[..., None] * vector[:, :, None, :]
+        distances = np.hypot(offset[..., 0], offset[..., 1])
+        distances[:, :, 2] = np.where(np.all(np.isnan(roots[:, :, :2]), axis=(1, 2))[:, None], distances[:, :, 2], np.inf)
+        rows = np.arange(len(points))
+        best = np.nanargmin(distances.reshape(len(points), -1), axis=1)
+        segment, root = best // 3, best % 3
+        t = roots[rows, segment, root]
+        idx, vector, dn, relative = idx[rows, segment], vector[rows, segment], dn[rows, segment], relative[rows, segment]
+        offset = relative - t[:, None] * vector
+        normal = self.normal[idx] + t[:, None] * dn
+        d = np.sum(offset * normal, axis=1) / np.hypot(normal[:, 0], normal[:, 1])
+        # Implicit derivative of the root, which is smooth across center points too since neighbouring segments share
+        # their end normals, or of the clipped projection for the fallback
+        on_normal = (root < 2)[:, None]
+        on_segment = ((root == 2) & (t > 0) & (t < 1))[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gradient = np.column_stack((normal[:, 1], -normal[:, 0])) / (cross(dn, offset) - cross(normal, vector))[:, None]
+        gradient = np.where(on_normal, gradient, np.where(on_segment, vector / self.segment_length_sq[idx, None], 0))
+        return index, segments[rows, segment], t, d, gradient
+
+    def index_to_s(self, indices):
+        # Arc length at unwrapped center point indices such as tpx
+        lap, idx = np.divmod(np.asarray(indices), len(self.center_coords))
+        return lap * self.track_length + self.arc_length[idx]
+
+    def to_frenet(self, xs, ys, init_px=0, point_horizon=400):
+        """
+        Frenet coordinates of every (x, y) relative to the centerline, searched from init_px like find_pos_indices.
+        s is the arc length along the centerline and keeps counting up across laps, d the signed lateral offset.
+        """
+        _, segment, t, d, _ = self._project_near_index(init_px, xs, ys, point_horizon)
+        return self.index_to_s(segment) + t * self.segment_length[segment % len(self.center_coords)], d
+
+    def from_frenet(self, s, d):
+        # Inverse of to_frenet, returns the x and y coordinates for every (s, d)
+        s = np.mod(np.ravel(s).astype(float), self.track_length)
+        idx = np.clip(np.searchsorted(self.arc_length, s, side='right') - 1, 0, len(self.center_coords) - 1)
+        center, normal = self._frame(idx, (s - self.arc_length[idx]) / self.segment_length[idx])
+        points = center + np.ravel(d)[:, None] * normal
+        return points[:, 0], points[:, 1]
+
+    def progress(self, init_px, xs, ys, point_horizon=400):
+        # Arc length s of every (x, y) as in to_frenet, together with its gradient with respect to (x, y)
+        _, segment, t, _, gradient = self._project_near_index(init_px, xs, ys, point_horizon)
+        length = self.segment_length[segment % len(self.center_coords)]
+        return self.index_to_s(segment) + t * length, gradient * length[:, None]
+
+    def locate(self, init_px, xs, ys, point_horizon=400):
+        # Closest center point indices, arc lengths and lateral offsets of car positions, as tracked in FleetState
+        index, segment, t, d, _ = self._project_near_index(init_px, xs, ys, point_horizon)
+        return index, self.index_to_s(segment) + t * self.segment_length[segment % len(self.center_coords)], d
+
+    def without_vehicles(self):
+        # Copy that shares the track geometry but none of the cars, e.g. for shipping to planning workers
+        track = copy(self)
+        track._reset_vehicles()
+        return track
 
     def place_car_of_type(self, car_type, x, y, dx, dy, d2x, d2y, heading, car_profile, optimizer_parameters):
         car = car_type(x, y, dx, dy, d2x, d2y, heading, car_profile, self, optimizer_parameters)
         self.vehicles_on_track.append(car)
+        self.interactions.add(car)
         self.update_cars_ahead_side()
         return car
 
-    @lru_cache(maxsize=500)
     def distance_to_center(self, x, y):
-        point = geom.Point(x, y)
-        return point.distance(self.line)
+        # The closest point on the centerline lies on a segment with an end within half the longest segment of the
+        # closest center point, so projecting onto those segments is exact
+        nearest, _ = self.center_index.query((x, y))
+        idx = np.asarray(self.center_index.query_ball_point((x, y), nearest + np.max(self.segment_length) / 2 + 1e-9))
+        return float(self._project_to_segments(x, y, np.concatenate((idx, idx - 1)))[0][0])
 
-    @lru_cache(maxsize=500)
     def distance_to_center_custom_range(self, x, y, min_pt_hz, max_pt_hz):
-        line = geom.LineString(circ_slice(self.center_coords, min_pt_hz, max_pt_hz-min_pt_hz))
-        point = geom.Point(x, y)
-        return point.distance(line)
+        return float(self.closest_center_points(x, y, min_pt_hz, max_pt_hz)[0][0])
+
+    def closest_center_points(self, xs, ys, min_pt_hz, max_pt_hz):
+        # Distance from every (x, y) to the centerline through points [min_pt_hz, max_pt_hz) and the closest point on it
+        distances, closest, _, _ = self._project_to_segments(xs, ys, np.arange(min_pt_hz, max(max_pt_hz - 1, min_pt_hz + 1)))
+        if max_pt_hz - min_pt_hz < 2:
+            # A single centerline point, so there is no segment to project onto
+            closest = np.broadcast_to(self.segment_start[min_pt_hz % len(self.segment_start)], closest.shape)
+            distances = np.hypot(*(np.column_stack((np.ravel(xs), np.ravel(ys))) - closest).T)
+        return distances, closest
+
+    def _project_to_segments(self, xs, ys, segments):
+        points = np.column_stack((np.ravel(xs), np.ravel(ys))).astype(float)
+        idx = np.asarray(segments) % len(self.segment_start)
+        start, vector, length_sq = self.segment_start[idx], self.segment_vector[idx], self.segment_length_sq[idx]
+        relative = points[:, None, :] - start[None, :, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.sum(relative * vector, axis=2) / length_sq
+        t = np.clip(np.where(length_sq > 0, t, 0), 0, 1)
+        offset = relative - t[:, :, None] * vector
+        distances = np.hypot(offset[:, :, 0], offset[:, :, 1])
+        best = np.argmin(distances, axis=1)
+        rows = np.arange(len(points))
+        closest = start[best] + t[rows, best, None] * vector[best]
+        return distances[rows, best], closest, np.asarray(segments)[best], t[rows, best]
 
     # @staticmethod
     # def generate_track():
     #
     def get_car_ordering(self):
-        # Sort cars by tpx, velocity, and create data structures saying cars_ahead[car] car_behind[car] and car_side[car]
-        ordering = list(sorted(self.vehicles_on_track, key=lambda car: (car.state.tpx, car.state.v), reverse=True))
+        # Sort cars by progress along the track, then velocity
+        ordering = list(sorted(self.vehicles_on_track, key=lambda car: (car.state.s, car.state.v), reverse=True))
         return ordering
 
     def update_cars_ahead_side(self, time_step=0.5):
-        ordering = self.get_car_ordering()
-        for i in range(len(ordering) - 1, -1, -1):
-            car = ordering[i]
-            sweep = generate_heading_sweep(car, time_step)
-            self.cars_ahead[car] = []
-            self.cars_side[car] = []
-            for j in range(i):
-                if ordering[j].state.tpx == car.state.tpx:
-                    self.cars_side[car].append((ordering[j].state))
-                else:
-                    opponent = rect_from_center(ordering[j].state.x, ordering[j].state.y, ordering[j].state.l, ordering[j].state.w, ordering[j].state.heading)
-                    if sweep.intersects(opponent):
-                        self.cars_ahead[car].append((ordering[j].state))
-        print(self.cars_ahead, self.cars_side)
\ No newline at end of file
+        # cars_ahead[car] and cars_side[car] hold the states of the cars ahead of and beside car
+        self.interactions.update(time_step)
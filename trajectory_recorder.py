@@ -0,0 +1,85 @@
+import struct
+
+import numpy as np
+
+TRAJECTORY_DTYPE = np.dtype([('car', np.int32), ('time', np.float64), ('x', np.float64), ('y', np.float64),
+                             ('v', np.float64), ('heading', np.float64), ('steering', np.float64),
+                             ('distance', np.float64), ('s', np.float64)])
+
+# Fixed size reserved for the .npy header so that it can be rewritten in place with the final record count
+_HEADER_SIZE = 256
+
+
+def _npy_header(count):
+    header = repr({'descr': np.lib.format.dtype_to_descr(TRAJECTORY_DTYPE), 'fortran_order': False, 'shape': (count,)})
+    preamble = np.lib.format.magic(1, 0)
+    header = header.ljust(_HEADER_SIZE - len(preamble) - 2 - 1) + '\n'
+    return preamble + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def load_trajectory(path):
+    # Memory-maps a recording written by TrajectoryRecorder, so analysis never has to read the whole run into memory
+    return np.load(path, mmap_mode='r')
+
+
+def car_records(records, car):
+    return records[records['car'] == car]
+
+
+class TrajectoryRecorder:
+    """
+    Records one TRAJECTORY_DTYPE row per car and simulation step into a preallocated chunk. Full chunks are either
+    appended to a .npy file at path, which is readable with load_trajectory while and after the run, or kept in memory
+    when no path is given.
+    """
+    def __init__(self, num_cars, path=None, chunk_size=4096):
+        self.num_cars = num_cars
+        self.path = path
+        self._buffer = np.zeros(chunk_size, dtype=TRAJECTORY_DTYPE)
+        self._count = 0
+        self._flushed = 0
+        self._chunks = []
+        self.last = np.zeros(num_cars, dtype=TRAJECTORY_DTYPE)
+        self._file = None
+        if path is not None:
+            self._file = open(path, 'w+b')
+            self._file.write(_npy_header(0))
+            # Readable as an empty recording until the first chunk is flushed
+            self._file.flush()
+
+    def record(self, car, time, x, y, v, heading, steering, distance, s):
+        self._buffer[self._count] = (car, time, x, y, v, heading, steering, distance, s)
+        self.last[car] = self._buffer[self._count]
+        self._count += 1
+        if self._count == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        if not self._count:
+            return
+        if self._file is not None:
+            self._file.seek(0, 2)
+            self._buffer[:self._count].tofile(self._file)
+            self._file.seek(0)
+            self._file.write(_npy_header(self._flushed + self._count))
+            self._file.flush()
+        else:
+            self._chunks.append(self._buffer[:self._count].copy())
+        self._flushed += self._count
+        self._count = 0
+
+    def records(self):
+        self.flush()
+        if not self._flushed:
+            # np.load cannot memory-map an empty array
+            return np.zeros(0, dtype=TRAJECTORY_DTYPE)
+        if self.path is not None:
+            return load_trajectory(self.path)
+        self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0]
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -3,6 +3,9 @@ import itertools
 import math
 
 import numpy as np
+from scipy.special import ndtr, ndtri
+
+from collisions import box_corners, overlap_areas
 
 gravitational_acceleration = 9.8
 TPI = 2 * math.pi
@@ -35,14 +38,68 @@ def find_smallest_rotation(target_h, current_h):
         return rotation
 
 
+def find_smallest_rotations(target_h, current_h):
+    # find_smallest_rotation for arrays of headings
+    cw = np.sin(current_h - target_h) > 0
+    rotation = np.where(cw, np.where(current_h > target_h, target_h - current_h, -(current_h + TPI - target_h)),
+                        np.where(target_h > current_h, target_h - current_h, target_h + TPI - current_h))
+    close = np.abs(target_h - current_h) <= 1e-9 * np.maximum(np.abs(target_h), np.abs(current_h))
+    return np.where(close, 0, rotation)
+
+
+class OrientedBox:
+    """
+    Rectangle of length l along heading and width w centered on (x, y), e.g. a car's footprint. Intersection tests use
+    the separating axis theorem and areas the exact convex overlap of collisions.overlap_areas, so no shapely geometry
+    is built; polygon() gives the equivalent shapely polygon for rendering or for checking areas against shapely.
+    """
+    __slots__ = ('x', 'y', 'l', 'w', 'heading')
+
+    def __init__(self, x, y, l, w, heading):
+        self.x = x
+        self.y = y
+        self.l = l
+        self.w = w
+        self.heading = heading
+
+    @property
+    def bounds(self):
+        # (minx, miny, maxx, maxy) like shapely's bounds
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        ex = abs(self.l / 2 * c) + abs(self.w / 2 * s)
+        ey = abs(self.l / 2 * s) + abs(self.w / 2 * c)
+        return self.x - ex, self.y - ey, self.x + ex, self.y + ey
+
+    def corners(self):
+        return box_corners(self.x, self.y, self.l, self.w, self.heading)
+
+    def intersects(self, other):
+        # Separating axis test on the two axes of each box. Like shapely's intersects, touching boxes intersect.
+        dx, dy = other.x - self.x, other.y - self.y
+        c1, s1 = math.cos(self.heading), math.sin(self.heading)
+        c2, s2 = math.cos(other.heading), math.sin(other.heading)
+        for ux, uy in ((c1, s1), (-s1, c1), (c2, s2), (-s2, c2)):
+            r1 = self.l / 2 * abs(c1 * ux + s1 * uy) + self.w / 2 * abs(-s1 * ux + c1 * uy)
+            r2 = other.l / 2 * abs(c2 * ux + s2 * uy) + other.w / 2 * abs(-s2 * ux + c2 * uy)
+            if abs(dx * ux + dy * uy) > r1 + r2:
+                return False
+        return True
+
+    def intersection_area(self, other):
+        return float(overlap_areas(self.corners(), other.corners()))
+
+    def polygon(self):
+        return geom.Polygon(self.corners())
+
+
+def stack_corners(boxes):
+    # Corners of many OrientedBoxes at once, shape (len(boxes), 4, 2)
+    poses = np.array([(b.x, b.y, b.l, b.w, b.heading) for b in boxes], dtype=float).reshape(-1, 5)
+    return box_corners(*poses.T)
+
+
 def rect_from_center(x, y, l, w, rot):
-    # Adapted from stackoverflow here: https://stackoverflow.com/questions/41898990/find-corners-of-a-rotated-rectangle-given-its-center-point-and-rotation
-    tr = np.array([x + ((l / 2) * math.cos(rot)) - ((w / 2) * math.sin(rot)), y + ((l / 2) * math.sin(rot)) + ((w / 2) * math.cos(rot))])
-    tl = np.array([x - ((l / 2) * math.cos(rot)) - ((w / 2) * math.sin(rot)), y - ((l / 2) * math.sin(rot)) + ((w / 2) * math.cos(rot))])
-    bl = np.array([x - ((l / 2) * math.cos(rot)) + ((w / 2) * math.sin(rot)), y - ((l / 2) * math.sin(rot)) - ((w / 2) * math.cos(rot))])
-    br = np.array([x + ((l / 2) * math.cos(rot)) + ((w / 2) * math.sin(rot)), y + ((l / 2) * math.sin(rot)) - ((w / 2) * math.cos(rot))])
-    points = np.vstack([tr, tl, bl, br])
-    return geom.Polygon(points)
+    return OrientedBox(x, y, l, w, rot)
 
 
 def generate_arc_points(centerx, centery, radius, start_angle, end_angle, num_segments=100):
@@ -54,18 +111,92 @@ def generate_arc_points(centerx, centery, radius, start_angle, end_angle, num_se
     return np.column_stack([x, y])
 
 
+class HeadingSweep:
+    """
+    Region a car can sweep through next: the circular sector of radius v * time_step around the center of its front
+    edge, spanning half_angle to either side of its heading, joined to the front edge. It is the union of the trapezoid
+    between the front edge and the chord of the arc, and the circular segment beyond that chord, so boxes are tested
+    against it analytically; polygon() samples the arc into a shapely polygon for rendering.
+    """
+    __slots__ = ('x', 'y', 'heading', 'radius', 'half_width', 'half_angle')
+
+    def __init__(self, x, y, heading, radius, half_width, half_angle=math.pi/4):
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.radius = radius
+        self.half_width = half_width
+        self.half_angle = half_angle
+
+    def _local(self, corners):
+        # Coordinates along and across the heading, relative to the center of the front edge
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        dx, dy = corners[..., 0] - self.x, corners[..., 1] - self.y
+        return dx * c + dy * s, -dx * s + dy * c
+
+    def intersects_boxes(self, corners):
+        # Whether the sweep touches each of the boxes with corners (..., 4, 2), e.g. from stack_corners
+        f, l = self._local(np.asarray(corners, dtype=float))
+        a, b = self.radius * math.cos(self.half_angle), self.radius * math.sin(self.half_angle)
+        return self._trapezoid_intersects(f, l, a, b) | self._segment_intersects(f, l, a)
+
+    def intersects(self, box):
+        return bool(self.intersects_boxes(box.corners()))
+
+    def _trapezoid_intersects(self, f, l, a, b):
+        # Separating axis test against the trapezoid with corners (0, -hw), (a, -b), (a, b), (0, hw)
+        hw = self.half_width
+        trap_f = np.array([0, a, a, 0])
+        trap_l = np.array([-hw, -b, b, hw])
+        axes = [np.array([1., 0.]), np.array([hw - b, a]), np.array([b - hw, a])]
+        edge_f, edge_l = np.diff(f[..., :3], axis=-1), np.diff(l[..., :3], axis=-1)
+        separated = np.zeros(f.shape[:-1], dtype=bool)
+        for k in range(2):
+            # Box axes, perpendicular to two of its adjacent edges
+            uf, ul = -edge_l[..., k:k + 1], edge_f[..., k:k + 1]
+            box_p = f * uf + l * ul
+            trap_p = trap_f * uf + trap_l * ul
+            separated |= (box_p.max(axis=-1) < trap_p.min(axis=-1)) | (trap_p.max(axis=-1) < box_p.min(axis=-1))
+        for uf, ul in axes:
+            box_p = f * uf + l * ul
+            trap_p = trap_f * uf + trap_l * ul
+            separated |= (box_p.max(axis=-1) < trap_p.min()) | (trap_p.max() < box_p.min(axis=-1))
+        return ~separated
+
+    def _segment_intersects(self, f, l, a):
+        # The circular segment is the disc around the origin beyond the chord f = a. It touches a box iff the part of
+        # the box beyond the chord, a convex polygon bounded by pieces of the box's edges and of the chord, comes
+        # within radius of the origin.
+        df, dl = np.roll(f, -1, axis=-1) - f, np.roll(l, -1, axis=-1) - l
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(df != 0, (a - f) / df, np.where(f >= a, -np.inf, np.inf))
+        low = np.where(df > 0, np.maximum(t, 0), 0)
+        high = np.where(df > 0, 1, np.where(df < 0, np.minimum(t, 1), np.where(f >= a, 1, -1)))
+        length_sq = df ** 2 + dl ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            closest = np.where(length_sq > 0, -(f * df + l * dl) / length_sq, 0)
+        closest = np.clip(closest, low, high)
+        dist_sq = np.where(low <= high, (f + closest * df) ** 2 + (l + closest * dl) ** 2, np.inf).min(axis=-1)
+        # The piece of the chord inside the box
+        crossing = (df != 0) & (t >= 0) & (t <= 1)
+        cross_l = l + np.where(crossing, t, 0) * dl
+        low_l = np.where(crossing, cross_l, np.inf).min(axis=-1)
+        high_l = np.where(crossing, cross_l, -np.inf).max(axis=-1)
+        chord_sq = np.where(crossing.any(axis=-1), a ** 2 + np.clip(0, low_l, high_l) ** 2, np.inf)
+        return np.minimum(dist_sq, chord_sq) <= self.radius ** 2
+
+    def polygon(self, num_segments=100):
+        fx, fy = math.cos(self.heading), math.sin(self.heading)
+        arc_points = generate_arc_points(self.x, self.y, self.radius, self.heading - self.half_angle,
+                                         self.heading + self.half_angle, num_segments)
+        tr = np.array([self.x - self.half_width * fy, self.y + self.half_width * fx])
+        br = np.array([self.x + self.half_width * fy, self.y - self.half_width * fx])
+        return geom.Polygon(np.vstack([arc_points, tr, br]))
+
+
 def generate_heading_sweep(car, time_step, from_center=math.pi/4):
     centerx, centery = car.state.x + (car.state.l / 2) * math.cos(car.state.heading), car.state.y + (car.state.l / 2) * math.sin(car.state.heading)
-    tr = np.array([car.state.x + ((car.state.l / 2) * math.cos(car.state.heading)) - ((car.state.w / 2) * math.sin(car.state.heading)),
-                   car.state.y + ((car.state.l / 2) * math.sin(car.state.heading)) + ((car.state.w / 2) * math.cos(car.state.heading))])
-    br = np.array([car.state.x + ((car.state.l / 2) * math.cos(car.state.heading)) + ((car.state.w / 2) * math.sin(car.state.heading)),
-                   car.state.y + ((car.state.l / 2) * math.sin(car.state.heading)) - ((car.state.w / 2) * math.cos(car.state.heading))])
-    radius = car.state.v * time_step
-    start_angle, end_angle = car.state.heading-from_center, car.state.heading+from_center  # In degrees
-    arc_points = generate_arc_points(centerx, centery, radius, start_angle, end_angle)
-    poly_points = np.vstack([arc_points, tr, br])
-    sweep = geom.Polygon(poly_points)
-    return sweep
+    return HeadingSweep(centerx, centery, car.state.heading, car.state.v * time_step, car.state.w / 2, from_center)
 
 
 def pos_estimate_functions(xi, yi, vi, vf, hi, hf, dt):
@@ -80,6 +211,35 @@ def pos_estimate_functions(xi, yi, vi, vf, hi, hf, dt):
     h_pos = lambda t: math.atan2((vyi + ay*t),(vxi + ax*t))
     return x_pos,y_pos, h_pos
 
+def pos_estimates(xi, yi, vi, vf, hi, hf, dt, num=50):
+    # pos_estimate_functions evaluated at num evenly spaced times in [0, dt], as arrays of x, y and heading
+    t = np.linspace(0, dt, num)
+    vxi = vi * math.cos(hi)
+    vyi = vi * math.sin(hi)
+    ax = (vf * math.cos(hf) - vxi) / dt
+    ay = (vf * math.sin(hf) - vyi) / dt
+    return xi + vxi*t + 0.5*ax*t**2, yi + vyi*t + 0.5*ay*t**2, np.arctan2(vyi + ay*t, vxi + ax*t)
+
+class TruncatedNormalSampler:
+    """
+    Draws from normal distributions truncated to [low, high] by inverting their CDF, using a numpy Generator of its own
+    so that each user can have an independent and reproducible stream (e.g. seeded from SeedSequence.spawn). Intervals
+    above the mean are sampled in the mirrored lower tail, where ndtr keeps its precision. All arguments broadcast,
+    so many draws can be made in one call.
+    """
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self, mean, sd, low, high):
+        mean, sd, low, high = np.broadcast_arrays(*map(np.asarray, (mean, sd, low, high)))
+        alpha = (low - mean) / sd
+        beta = (high - mean) / sd
+        sign = np.where(alpha > 0, -1., 1.)
+        alpha, beta = np.where(sign < 0, -beta, alpha), np.where(sign < 0, -alpha, beta)
+        z = ndtri(self.rng.uniform(ndtr(alpha), ndtr(beta)))
+        return np.clip(mean + sign * sd * z, low, high)
+
+
 def is_greater_than(a, b, rel_tol = 1e-9, abs_tol=1e-6):
     if math.isclose(a, b, rel_tol=rel_tol, abs_tol=abs_tol):
         return False
@@ -0,0 +1,87 @@
+import os
+import sys
+from io import StringIO
+from threading import Timer
+
+import matplotlib.pyplot as plt
+
+from trajectory_recorder import car_records
+
+
+def use_interactive_backend():
+    plt.switch_backend('Qt5Agg')
+
+
+def car_color(idx):
+    return plt.get_cmap('tab20')(idx % 20)
+
+
+def plot_track(track):
+    plt.figure(1)
+    plt.plot(track.boundary1_x, track.boundary1_y, '.k-', label="Track Boundary Right")
+    plt.plot(track.boundary2_x, track.boundary2_y, '.k-', label="Track Boundary Left")
+    plt.plot(track.center_x, track.center_y, '.g-', label="Center Trajectory")
+
+
+def start_round(track):
+    plot_track(track)
+    plt.ion()
+
+
+def plot_trajectories(records, num_cars, car_boxes=None, annotation=None):
+    for idx in range(num_cars):
+        color = car_color(idx)
+        car = car_records(records, idx)
+        plt.figure(1)
+        plt.plot(car['x'], car['y'], '.-', color=color)
+        if car_boxes is not None:
+            plt.plot(*car_boxes[idx].polygon().exterior.xy, '-', color=color)
+        if annotation is not None and len(car):
+            plt.annotate(f"Car {idx} {annotation}", (car['x'][-1], car['y'][-1]), fontsize=3)
+        plt.figure(2)
+        plt.plot(car['distance'], car['v'], '.-', color=color)
+        plt.figure(3)
+        plt.plot(car['distance'], car['steering'], '.-', color=color)
+
+
+def save_figures(save_dir, prefix):
+    for figure, name in ((1, 'position'), (2, 'velocities'), (3, 'steering_angles')):
+        plt.figure(figure)
+        plt.savefig(os.path.join(save_dir, f"{prefix}_{name}.png"))
+
+
+def refresh():
+    plt.draw()
+    plt.show()
+    plt.pause(.01)
+
+
+def wait_for_user(timeout=None):
+    if timeout is not None:
+        plt.draw()
+        plt.show()
+        sys.stdin = StringIO('Continuing...')
+        t = Timer(timeout, print, [""], {'file': sys.stdin})
+        t.start()
+        plt.pause(timeout + 5)
+        typed = input(f"Press [enter] to continue, or simulation will automatically continue in {timeout} seconds\n")
+        print(typed)
+        t.cancel()
+    else:
+        plt.ioff()
+        plt.draw()
+        plt.show()
+        plt.ion()
+        input(f"Press [enter] to continue\n")
+
+
+def render_recording(track, records, num_cars, save_dir=None, show=True):
+    # Draws a finished (e.g. headless) run from the records Simulator.simulate returns or load_trajectory reads
+    plot_track(track)
+    plot_trajectories(records, num_cars)
+    if save_dir:
+        save_figures(save_dir, "final")
+    if show:
+        plt.ioff()
+        plt.draw()
+        plt.show()